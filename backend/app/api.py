@@ -1,117 +1,171 @@
+import sys
+import time
 import shutil
 import uuid
-import json
+import asyncio
+import zipfile
 from pathlib import Path
 from fastapi import (
-    APIRouter, BackgroundTasks, File, UploadFile, HTTPException
+    APIRouter, File, UploadFile, HTTPException
 )
-from fastapi.responses import FileResponse, JSONResponse
-from typing import List
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional
 import aiofiles
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
-from app.logic.clean_dataset import clean_dataset
-from app.logic.augment_dataset import main as augment_dataset_main
-from app.logic.utils import validate_dataset_structure, create_zip_from_directory
+# Nothing imported here may load OpenCV or NumPy: the cleaning/augmentation code lives in app.tasks,
+# which only the job worker processes import, so API workers start fast.
+from app.config import BASE_DIR, JOBS_DB, JOB_WORKERS, JOB_QUEUE_LIMIT, UPLOAD_CHUNK_SIZE, UPLOAD_CONCURRENCY
+from app.logic.metrics import StageMetrics
+from app.logic.utils import validate_dataset_structure, iter_zip_stream, dataset_members_in_zip, extract_zip_streaming
+from app.jobs import JobRunner, JobStore
 from app.schemas import AugmentationParams, JobStatusResponse, UploadResponse, CleaningParams
 
 router = APIRouter()
-JOBS = {}
-BASE_DIR = Path("data")
-BASE_DIR.mkdir(exist_ok=True)
 
-# --- Upload endpoint is unchanged ---
+# Job state lives in SQLite so it survives restarts and is shared between uvicorn workers.
+JOBS = JobStore(JOBS_DB)
+# Also fails jobs whose owning API process is gone (e.g. after a restart), now and periodically.
+JOB_RUNNER = JobRunner(JOBS, max_workers=JOB_WORKERS, max_queued=JOB_QUEUE_LIMIT)
+
+def _peak_rss_bytes() -> Optional[int]:
+    # High-water mark of this API process since it started, not just of this upload.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+async def _stream_to_disk(file: UploadFile, save_path: Path, semaphore: asyncio.Semaphore, ingest: dict) -> None:
+    async with semaphore:
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(save_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                ingest["buffered_bytes"] += len(chunk)
+                ingest["peak_buffer_bytes"] = max(ingest["peak_buffer_bytes"], ingest["buffered_bytes"])
+                await buffer.write(chunk)
+                ingest["buffered_bytes"] -= len(chunk)
+                ingest["bytes"] += len(chunk)
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_dataset(files: List[UploadFile] = File(...)):
     job_id = str(uuid.uuid4())
     job_dir = BASE_DIR / job_id
     raw_path = job_dir / "raw"
     raw_path.mkdir(parents=True, exist_ok=True)
-    filenames = [f.filename for f in files if f.filename]
-    is_valid, message = validate_dataset_structure(filenames)
-    if not is_valid: raise HTTPException(status_code=400, detail=message)
-    for file in files:
-        if not file.filename: continue
-        save_path = raw_path / Path(file.filename)
-        save_path.parent.mkdir(parents=True, exist_ok=True)
-        async with aiofiles.open(save_path, "wb") as buffer:
-            content = await file.read()
-            await buffer.write(content)
-    JOBS[job_id] = {"status": "uploaded", "path": str(job_dir)}
-    return UploadResponse(job_id=job_id, status="uploaded", message="Dataset uploaded successfully.", filenames=filenames)
+    started = time.perf_counter()
+    ingest = {"bytes": 0, "buffered_bytes": 0, "peak_buffer_bytes": 0}
+    semaphore = asyncio.Semaphore(max(1, UPLOAD_CONCURRENCY))
 
-# --- Cleaning task is unchanged ---
-def _run_cleaning_task(job_id: str, params: CleaningParams):
-    job_dir = BASE_DIR / job_id
-    try:
-        with open(job_dir / "raw" / "classes.txt", "r") as f:
-            classes = [line.strip() for line in f if line.strip()]
-        stats = clean_dataset(
-            base_path=job_dir / "raw", output_path=job_dir / "cleaned",
-            classes=classes, remove_unlabeled_images=params.remove_unlabeled_images
-        )
-        JOBS[job_id].update({"status": "cleaned", "clean_stats": stats})
-        create_zip_from_directory(job_dir / "cleaned", job_dir / "cleaned_dataset")
-    except Exception as e:
-        JOBS[job_id].update({"status": "error", "details": {"error": f"Cleaning failed: {str(e)}", "stage": "cleaning"}})
-
-# --- THIS IS THE NEW, MORE ROBUST AUGMENTATION TASK ---
-def _run_augmentation_task(job_id: str, params: AugmentationParams):
-    job_dir = BASE_DIR / job_id
-    cleaned_dir = job_dir / "cleaned"
-    augmented_dir = job_dir / "augmented"
-    
+    is_zip_upload = len(files) == 1 and (files[0].filename or "").lower().endswith(".zip")
     try:
-        # Step 1: Robocopy the entire cleaned dataset to the augmented directory first.
-        # This guarantees all original files (images, labels, no_label) are present.
-        if augmented_dir.exists():
-            shutil.rmtree(augmented_dir)
-        shutil.copytree(cleaned_dir, augmented_dir)
-
-        # Step 2: Call the simplified augmentation script to work IN-PLACE.
-        # It will now add its new files to the already-copied dataset.
-        report = augment_dataset_main(
-            data_dir=augmented_dir, # Only one directory parameter now
-            seed=params.random_seed, 
-            enabled_augmentations=params.enabled_augmentations,
-            augmentation_cap=params.augmentation_cap
-        )
-        
-        # Step 3: Save the report and zip the final, complete directory.
-        with open(augmented_dir / "report.json", 'w') as f:
-            json.dump(report, f, indent=4)
-        
-        JOBS[job_id].update({"status": "augmented", "augment_report": report})
-        create_zip_from_directory(augmented_dir, job_dir / "augmented_dataset")
-
-    except Exception as e:
-        JOBS[job_id].update({"status": "error", "details": {"error": f"Augmentation failed: {str(e)}", "stage": "augmentation"}})
-
-# --- Endpoints below are unchanged ---
+        if is_zip_upload:
+            # A single ZIP is streamed to disk as-is, then unpacked member by member.
+            zip_path = job_dir / "upload.zip"
+            await _stream_to_disk(files[0], zip_path, semaphore, ingest)
+            try:
+                with zipfile.ZipFile(zip_path) as archive:
+                    filenames = list(dataset_members_in_zip(archive))
+                is_valid, message = validate_dataset_structure(filenames)
+                if not is_valid: raise HTTPException(status_code=400, detail=message)
+                # A damaged member (bad CRC) only shows up while it is extracted.
+                await run_in_threadpool(extract_zip_streaming, zip_path, raw_path, UPLOAD_CHUNK_SIZE)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="Error: The uploaded ZIP archive is corrupted.")
+            zip_path.unlink()
+        else:
+            filenames = [f.filename for f in files if f.filename]
+            is_valid, message = validate_dataset_structure(filenames)
+            if not is_valid: raise HTTPException(status_code=400, detail=message)
+            await asyncio.gather(*(
+                _stream_to_disk(file, raw_path / Path(file.filename), semaphore, ingest)
+                for file in files if file.filename
+            ))
+    except BaseException:
+        # No job record exists yet, so nothing else would ever clean up a half-written upload.
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    elapsed = time.perf_counter() - started
+    JOBS.create(job_id, {"status": "uploaded", "path": str(job_dir), "ingest": {
+        "source": "zip" if is_zip_upload else "files",
+        "files": len(filenames),
+        "bytes": ingest["bytes"],
+        "seconds": round(elapsed, 3),
+        "throughput_mb_s": round(ingest["bytes"] / (1024 * 1024) / elapsed, 2) if elapsed > 0 else None,
+        "peak_buffer_bytes": ingest["peak_buffer_bytes"],
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "concurrency": max(1, UPLOAD_CONCURRENCY),
+    }})
+    return UploadResponse(job_id=job_id, status="uploaded", message="Dataset uploaded successfully.", filenames=filenames)
+
+# --- Endpoints ---
+def _queue_full() -> HTTPException:
+    return HTTPException(status_code=503, detail="Too many jobs are queued. Please try again shortly.")
+
 @router.post("/clean/{job_id}", response_model=JobStatusResponse)
-async def start_cleaning(job_id: str, params: CleaningParams, background_tasks: BackgroundTasks):
+async def start_cleaning(job_id: str, params: CleaningParams):
     if job_id not in JOBS: raise HTTPException(status_code=404, detail="Job not found")
-    JOBS[job_id]["status"] = "cleaning"
-    background_tasks.add_task(_run_cleaning_task, job_id, params)
+    if not JOB_RUNNER.submit(job_id, {"status": "cleaning"}, "cleaning", "app.tasks:run_cleaning_task", params):
+        raise _queue_full()
     return JobStatusResponse(job_id=job_id, status="cleaning")
 
 @router.post("/augment/{job_id}", response_model=JobStatusResponse)
-async def start_augmentation(job_id: str, params: AugmentationParams, background_tasks: BackgroundTasks):
-    if job_id not in JOBS or JOBS[job_id].get("status") != "cleaned":
+async def start_augmentation(job_id: str, params: AugmentationParams):
+    job = JOBS.get(job_id)
+    if job is None or job.get("status") != "cleaned":
         raise HTTPException(status_code=400, detail="Dataset not found or not cleaned yet.")
-    JOBS[job_id]["status"] = "augmenting"
-    background_tasks.add_task(_run_augmentation_task, job_id, params)
+    if not JOB_RUNNER.submit(job_id, {"status": "augmenting"}, "augmentation", "app.tasks:run_augmentation_task", params):
+        raise _queue_full()
     return JobStatusResponse(job_id=job_id, status="augmenting")
 
 @router.get("/status/{job_id}")
 async def get_job_status(job_id: str):
-    if job_id not in JOBS: raise HTTPException(status_code=404, detail="Job not found")
-    return JSONResponse(content=JOBS[job_id])
+    job = JOBS.get(job_id)
+    if job is None: raise HTTPException(status_code=404, detail="Job not found")
+    job["queue"] = {**JOBS.queue_info(job_id), **JOB_RUNNER.info()}
+    return JSONResponse(content=job)
+
+# Job statuses in which each result directory is complete and safe to export.
+RESULT_READY_STATUSES = {"cleaned": {"cleaned", "augmenting", "augmented"}, "augmented": {"augmented"}}
+
+def _result_ready(job: dict, result_type: str) -> bool:
+    # A failed augmentation (or one interrupted by a restart) leaves the cleaned dataset complete, so it stays downloadable.
+    if result_type == "cleaned" and job.get("status") == "error":
+        return (job.get("details") or {}).get("stage") == "augmentation"
+    return job.get("status") in RESULT_READY_STATUSES[result_type]
+
+def _timed_export(job_id: str, result_type: str, chunks, metrics: StageMetrics):
+    # Passes the archive through while recording time-to-first-byte and total export time on the job.
+    started = time.perf_counter()
+    export = {"bytes": 0, "ttfb_seconds": None, "completed": False}
+    try:
+        for chunk in chunks:
+            if export["ttfb_seconds"] is None:
+                export["ttfb_seconds"] = round(time.perf_counter() - started, 4)
+            export["bytes"] += len(chunk)
+            yield chunk
+        export["completed"] = True
+    finally:
+        export["total_seconds"] = round(time.perf_counter() - started, 4)
+        JOBS.update(job_id, {f"{result_type}_export": export, f"{result_type}_export_metrics": metrics.snapshot()})
 
 @router.get("/download/{job_id}/{result_type}")
 async def download_results(job_id: str, result_type: str):
-    if job_id not in JOBS: raise HTTPException(status_code=404, detail="Job not found")
+    job = JOBS.get(job_id)
+    if job is None: raise HTTPException(status_code=404, detail="Job not found")
     if result_type not in ["cleaned", "augmented"]: raise HTTPException(status_code=400, detail="Invalid result type.")
-    zip_path = BASE_DIR / job_id / f"{result_type}_dataset.zip"
-    if not zip_path.exists():
+    result_dir = BASE_DIR / job_id / result_type
+    if not _result_ready(job, result_type) or not result_dir.exists():
         raise HTTPException(status_code=404, detail="Result archive not found. The job may still be running or has failed.")
-    return FileResponse(path=zip_path, media_type='application/zip', filename=f"{result_type}_dataset_{job_id[:8]}.zip")
\ No newline at end of file
+    # The archive is generated while it is sent, so the download starts immediately and no temp ZIP is written.
+    metrics = StageMetrics(f"{result_type}_export")
+    return StreamingResponse(
+        _timed_export(job_id, result_type, iter_zip_stream(result_dir, metrics=metrics), metrics),
+        media_type='application/zip',
+        headers={"Content-Disposition": f'attachment; filename="{result_type}_dataset_{job_id[:8]}.zip"'}
+    )
\ No newline at end of file
@@ -0,0 +1,19 @@
+import os
+from pathlib import Path
+
+# Settings shared by the API process and the job worker processes.
+BASE_DIR = Path("data")
+BASE_DIR.mkdir(exist_ok=True)
+JOBS_DB = BASE_DIR / "jobs.db"
+
+# Cleaning/augmentation run in a bounded pool of worker processes, never in the API process itself.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", 16))
+
+# Uploads are streamed to disk in fixed-size chunks, with at most UPLOAD_CONCURRENCY files in flight,
+# so peak buffered memory is bounded by UPLOAD_CHUNK_SIZE * UPLOAD_CONCURRENCY whatever the dataset size.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", 4))
+
+# Running tasks save a metrics snapshot on the job record at most this often, for /status and /metrics.
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", 1.0))
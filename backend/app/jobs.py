@@ -0,0 +1,261 @@
+import json
+import time
+import uuid
+import sqlite3
+import importlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Union
+
+# API processes refresh their heartbeat this often; jobs whose owner missed it for ORPHAN_TIMEOUT seconds are failed.
+HEARTBEAT_INTERVAL = 5.0
+ORPHAN_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+class JobStore:
+    """
+    Durable job records backed by a single SQLite file.
+    Every call opens its own connection, so the store can be shared by API threads,
+    several uvicorn workers and the task processes that update job progress.
+    Each store gets a random `instance_id`; jobs it enqueues are owned by that id.
+    """
+    def __init__(self, db_path: Path, instance_id: Optional[str] = None):
+        self.db_path = Path(db_path)
+        self.instance_id = instance_id or uuid.uuid4().hex
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " record TEXT NOT NULL,"
+                " queue_state TEXT,"      # NULL, 'queued' or 'running'
+                " owner_instance TEXT,"   # instance_id of the API process that owns the queued/running task
+                " queue_stage TEXT,"      # stage name reported if the queued/running task fails, e.g. 'augmentation'
+                " enqueued_at REAL,"
+                " updated_at REAL NOT NULL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner_instance" not in columns:  # database created by a version that stored the owner's PID
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner_instance TEXT")
+            if "queue_stage" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN queue_stage TEXT")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS instances ("
+                " instance_id TEXT PRIMARY KEY,"
+                " heartbeat_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write cycles from
+        # different processes cannot interleave and lose updates.
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.get(job_id) is not None
+
+    def create(self, job_id: str, record: Dict) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, record, updated_at) VALUES (?, ?, ?)",
+                (job_id, json.dumps(record), time.time())
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id: str, fields: Dict) -> None:
+        """Merges `fields` into the stored record, like dict.update()."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise KeyError(job_id)
+            record = json.loads(row[0])
+            record.update(fields)
+            conn.execute(
+                "UPDATE jobs SET record = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(record), time.time(), job_id)
+            )
+
+    def records(self) -> Iterator[Dict]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT record FROM jobs").fetchall()
+        return (json.loads(row[0]) for row in rows)
+
+    def enqueue(self, job_id: str, fields: Dict, limit: int, stage: Optional[str] = None) -> bool:
+        """
+        Atomically applies `fields` and marks the job as queued, unless `limit` jobs are already waiting.
+        `stage` is the name recorded in the job's error details if the task is lost (defaults to its status).
+        Returns False when the job was rejected by admission control.
+        """
+        with self._transaction() as conn:
+            (waiting,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE queue_state = 'queued'").fetchone()
+            row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or waiting >= limit:
+                return False
+            record = json.loads(row[0])
+            record.update(fields)
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET record = ?, queue_state = 'queued', queue_stage = ?, owner_instance = ?,"
+                " enqueued_at = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(record), stage, self.instance_id, now, now, job_id)
+            )
+            return True
+
+    def set_queue_state(self, job_id: str, state: Optional[str]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET queue_state = ?, updated_at = ? WHERE job_id = ?",
+                (state, time.time(), job_id)
+            )
+
+    def queue_info(self, job_id: Optional[str] = None) -> Dict:
+        with self._connect() as conn:
+            counts = dict(conn.execute(
+                "SELECT queue_state, COUNT(*) FROM jobs WHERE queue_state IS NOT NULL GROUP BY queue_state"
+            ).fetchall())
+            info = {"depth": counts.get("queued", 0), "running": counts.get("running", 0)}
+            if job_id is not None:
+                row = conn.execute("SELECT queue_state, enqueued_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is not None:
+                    info["state"] = row[0]
+                    if row[0] == "queued":
+                        (ahead,) = conn.execute(
+                            "SELECT COUNT(*) FROM jobs WHERE queue_state = 'queued' AND enqueued_at < ?", (row[1],)
+                        ).fetchone()
+                        info["position"] = ahead + 1
+        return info
+
+    def heartbeat(self) -> None:
+        """Records that this store's process is alive, so the jobs it owns are not taken for orphans."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO instances (instance_id, heartbeat_at) VALUES (?, ?)"
+                " ON CONFLICT(instance_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                (self.instance_id, time.time())
+            )
+
+    def fail_orphaned_jobs(self, stale_after: float = ORPHAN_TIMEOUT) -> None:
+        """
+        Marks queued/running jobs as failed when the API process that owns them stopped sending heartbeats
+        for `stale_after` seconds (e.g. it was restarted). Owners are random per-process ids, not PIDs,
+        because a restarted container usually reuses the same PID.
+        """
+        cutoff = time.time() - stale_after
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT jobs.job_id, jobs.queue_stage FROM jobs LEFT JOIN instances ON instances.instance_id = jobs.owner_instance"
+                " WHERE jobs.queue_state IS NOT NULL AND (jobs.owner_instance IS NULL OR"
+                " (jobs.owner_instance != ? AND (instances.heartbeat_at IS NULL OR instances.heartbeat_at < ?)))",
+                (self.instance_id, cutoff)
+            ).fetchall()
+            conn.execute("DELETE FROM instances WHERE heartbeat_at < ? AND instance_id != ?", (cutoff, self.instance_id))
+        for job_id, stage in rows:
+            # Same stage name the task itself reports on failure, so readers need not know both spellings.
+            stage = stage or (self.get(job_id) or {}).get("status", "unknown")
+            self.update(job_id, {"status": "error", "details": {"error": "Job was interrupted by a server restart.", "stage": stage}})
+            self.set_queue_state(job_id, None)
+
+def _resolve_task(func: Union[Callable, str]) -> Callable:
+    # "package.module:function" is imported here, in the worker, so the submitting process never loads it.
+    if isinstance(func, str):
+        module, _, name = func.partition(":")
+        return getattr(importlib.import_module(module), name)
+    return func
+
+def _execute_job(db_path: Path, job_id: str, func: Union[Callable, str], args: tuple) -> None:
+    # Runs inside a pool process.
+    store = JobStore(db_path)
+    store.set_queue_state(job_id, "running")
+    try:
+        _resolve_task(func)(job_id, *args)
+    finally:
+        store.set_queue_state(job_id, None)
+
+class JobRunner:
+    """
+    Bounded pool of worker processes that runs the heavy cleaning/augmentation tasks outside the API process.
+    Admission control rejects new work once `max_queued` jobs are waiting across all API workers.
+    Tasks can be given as `"package.module:function"`, so their (heavy) modules are only imported by the workers.
+    A background thread keeps the store's heartbeat fresh and fails jobs left behind by API processes that died.
+    """
+    def __init__(self, store: JobStore, max_workers: int, max_queued: int, heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        self.store = store
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._heartbeat_interval = heartbeat_interval
+        self._stopped = threading.Event()
+        self._beat()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self) -> None:
+        self.store.heartbeat()
+        self.store.fail_orphaned_jobs(stale_after=3 * self._heartbeat_interval)
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stopped.wait(self._heartbeat_interval):
+            try:
+                self._beat()
+            except Exception:
+                pass  # e.g. the database is briefly locked; the next beat retries
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # "spawn" keeps the workers independent of the API process's threads and event loop.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def submit(self, job_id: str, fields: Dict, stage: str, func: Union[Callable, str], *args) -> bool:
+        if not self.store.enqueue(job_id, fields, self.max_queued, stage):
+            return False
+        try:
+            future = self._get_executor().submit(_execute_job, self.store.db_path, job_id, func, args)
+        except BrokenProcessPool:
+            # A worker died hard (e.g. OOM-killed); start a fresh pool for new work.
+            self._executor = None
+            future = self._get_executor().submit(_execute_job, self.store.db_path, job_id, func, args)
+        future.add_done_callback(lambda f: self._on_done(f, job_id, stage))
+        return True
+
+    def _on_done(self, future: Future, job_id: str, stage: str) -> None:
+        error = future.exception()
+        if error is None:
+            return
+        # The task handles its own errors; reaching here means the worker process itself failed.
+        self.store.set_queue_state(job_id, None)
+        self.store.update(job_id, {"status": "error", "details": {"error": f"Worker failed: {error!r}", "stage": stage}})
+
+    def info(self) -> Dict:
+        return {"workers": self.max_workers, "max_queued": self.max_queued}
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
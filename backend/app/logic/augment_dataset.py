@@ -3,12 +3,22 @@ import cv2
 import random
 import json
 import shutil
+import time
+import threading
+from collections import OrderedDict
 from pathlib import Path
 import numpy as np
 from typing import List, Dict, Optional, Tuple, Callable
 
-# --- Augmentation Functions (These are fine and do not need changes) ---
-def flip(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
+from .label_index import LabelIndex
+from .label_io import LabelWriteBuffer
+from .metrics import StageMetrics
+from .pipeline import run_pipeline
+from .shards import ShardReader, ShardWriter, is_packed_dataset
+
+# --- Augmentation Functions ---
+# Each function takes an optional `rng` (a random.Random); it defaults to the global `random` module.
+def flip(img: np.ndarray, bboxes: list, rng=random) -> Tuple[np.ndarray, list]:
     img_flipped = cv2.flip(img, 1)
     new_bboxes = []
     for box in bboxes:
@@ -16,11 +26,11 @@ def flip(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
         new_x_center = 1.0 - x_center
         new_bboxes.append([class_id, new_x_center, y_center, width, height])
     return img_flipped, new_bboxes
-def adjust_color(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
-    beta = random.randint(-40, 40); alpha = random.uniform(0.7, 1.3)
+def adjust_color(img: np.ndarray, bboxes: list, rng=random) -> Tuple[np.ndarray, list]:
+    beta = rng.randint(-40, 40); alpha = rng.uniform(0.7, 1.3)
     return cv2.convertScaleAbs(img, alpha=alpha, beta=beta), bboxes
-def rotate(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
-    h, w = img.shape[:2]; angle = random.uniform(-10, 10)
+def rotate(img: np.ndarray, bboxes: list, rng=random) -> Tuple[np.ndarray, list]:
+    h, w = img.shape[:2]; angle = rng.uniform(-10, 10)
     M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1)
     img_rotated = cv2.warpAffine(img, M, (w, h)); rad_angle = -np.deg2rad(angle)
     cos_a, sin_a = np.cos(rad_angle), np.sin(rad_angle)
@@ -32,8 +42,8 @@ def rotate(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
         new_py_c = (px_c_centered*sin_a + py_c_centered*cos_a) + h/2
         new_bboxes.append([class_id, new_px_c/w, new_py_c/h, width, height])
     return img_rotated, new_bboxes
-def scale(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
-    h, w = img.shape[:2]; scale_factor = random.uniform(0.9, 1.1)
+def scale(img: np.ndarray, bboxes: list, rng=random) -> Tuple[np.ndarray, list]:
+    h, w = img.shape[:2]; scale_factor = rng.uniform(0.9, 1.1)
     nh, nw = int(h * scale_factor), int(w * scale_factor)
     img_resized = cv2.resize(img, (nw, nh)); canvas = np.full((h, w, 3), 128, dtype=np.uint8)
     x_off, y_off = (w - nw) // 2, (h - nh) // 2
@@ -46,50 +56,334 @@ def scale(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
         class_id, x_c, y_c, width, height = box
         new_bboxes.append([class_id, (x_c*nw+x_off)/w, (y_c*nh+y_off)/h, width*scale_factor, height*scale_factor])
     return canvas, new_bboxes
-def translate(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
-    h, w = img.shape[:2]; tx, ty = random.uniform(-0.1, 0.1)*w, random.uniform(-0.1, 0.1)*h
+def translate(img: np.ndarray, bboxes: list, rng=random) -> Tuple[np.ndarray, list]:
+    h, w = img.shape[:2]; tx, ty = rng.uniform(-0.1, 0.1)*w, rng.uniform(-0.1, 0.1)*h
     M = np.float32([[1, 0, tx], [0, 1, ty]]); img_translated = cv2.warpAffine(img, M, (w, h))
     new_bboxes = []
     for box in bboxes:
         class_id, x_c, y_c, width, height = box
         new_bboxes.append([class_id, x_c+tx/w, y_c+ty/h, width, height])
     return img_translated, new_bboxes
-def add_gaussian_blur(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
-    return cv2.GaussianBlur(img, (random.choice([3, 5, 7]), random.choice([3, 5, 7])), 0), bboxes
-def cutout(img: np.ndarray, bboxes: list) -> Tuple[np.ndarray, list]:
+def add_gaussian_blur(img: np.ndarray, bboxes: list, rng=random) -> Tuple[np.ndarray, list]:
+    return cv2.GaussianBlur(img, (rng.choice([3, 5, 7]), rng.choice([3, 5, 7])), 0), bboxes
+def cutout(img: np.ndarray, bboxes: list, rng=random) -> Tuple[np.ndarray, list]:
     h, w = img.shape[:2]
-    for _ in range(random.randint(1, 3)):
-        size_h, size_w = int(h*random.uniform(0.05, 0.15)), int(w*random.uniform(0.05, 0.15))
-        x, y = random.randint(0, w - size_w), random.randint(0, h - size_h)
+    for _ in range(rng.randint(1, 3)):
+        size_h, size_w = int(h*rng.uniform(0.05, 0.15)), int(w*rng.uniform(0.05, 0.15))
+        x, y = rng.randint(0, w - size_w), rng.randint(0, h - size_h)
         img[y:y+size_h, x:x+size_w] = (128, 128, 128)
     return img, bboxes
 AUGMENTATION_MAP: Dict[str, Callable] = {'flip': flip, 'color': adjust_color, 'rotate': rotate, 'scale': scale, 'translate': translate, 'blur': add_gaussian_blur, 'cutout': cutout}
 
-# --- THIS IS THE FINAL, CORRECT MAIN LOGIC ---
-def main(data_dir: Path, seed: int, enabled_augmentations: List[str], augmentation_cap: Optional[int]) -> Dict:
-    random.seed(seed)
-    np.random.seed(seed)
+# --- Fused Composition ---
+# Geometric ops are expressed as 3x3 affine matrices in continuous pixel coordinates (pixel i spans [i, i+1)).
+# A composition multiplies them into one matrix, so the image is resampled by a single warpAffine and each
+# bbox's four corners are mapped once; the new box is the axis-aligned envelope of the mapped corners,
+# clipped to the image. Photometric ops then run in place on the warped buffer.
+# Parameter ranges match the single-image functions above.
+def _flip_matrix(w: int, h: int, rng=random) -> np.ndarray:
+    return np.array([[-1, 0, w], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+def _rotate_matrix(w: int, h: int, rng=random) -> np.ndarray:
+    return np.vstack([cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-10, 10), 1), [0, 0, 1]])
+def _scale_matrix(w: int, h: int, rng=random) -> np.ndarray:
+    return np.vstack([cv2.getRotationMatrix2D((w / 2, h / 2), 0, rng.uniform(0.9, 1.1)), [0, 0, 1]])
+def _translate_matrix(w: int, h: int, rng=random) -> np.ndarray:
+    tx, ty = rng.uniform(-0.1, 0.1)*w, rng.uniform(-0.1, 0.1)*h
+    return np.array([[1, 0, tx], [0, 1, ty], [0, 0, 1]], dtype=np.float64)
+def _color_inplace(img: np.ndarray, rng=random) -> None:
+    beta = rng.randint(-40, 40); alpha = rng.uniform(0.7, 1.3)
+    cv2.convertScaleAbs(img, dst=img, alpha=alpha, beta=beta)
+def _blur_inplace(img: np.ndarray, rng=random) -> None:
+    cv2.GaussianBlur(img, (rng.choice([3, 5, 7]), rng.choice([3, 5, 7])), 0, dst=img)
+def _cutout_inplace(img: np.ndarray, rng=random) -> None:
+    cutout(img, [], rng)
+GEOMETRIC_MATRIX_MAP: Dict[str, Callable[..., np.ndarray]] = {'flip': _flip_matrix, 'rotate': _rotate_matrix, 'scale': _scale_matrix, 'translate': _translate_matrix}
+PHOTOMETRIC_INPLACE_MAP: Dict[str, Callable[..., None]] = {'color': _color_inplace, 'blur': _blur_inplace, 'cutout': _cutout_inplace}
+# Order in which a composition applies its ops, whatever order they were requested in.
+COMPOSE_ORDER = ['flip', 'rotate', 'scale', 'translate', 'color', 'blur', 'cutout']
+
+def transform_bboxes(bboxes: list, M: np.ndarray, w: int, h: int) -> list:
+    """Maps boxes through an affine pixel-space matrix and returns the clipped envelopes of their corners."""
+    if not bboxes:
+        return []
+    coords = np.array([box[1:5] for box in bboxes], dtype=np.float64)
+    x1, x2 = (coords[:, 0] - coords[:, 2] / 2) * w, (coords[:, 0] + coords[:, 2] / 2) * w
+    y1, y2 = (coords[:, 1] - coords[:, 3] / 2) * h, (coords[:, 1] + coords[:, 3] / 2) * h
+    corners = np.stack([np.stack([x1, y1], -1), np.stack([x2, y1], -1), np.stack([x1, y2], -1), np.stack([x2, y2], -1)], 1)
+    mapped = corners @ M[:2, :2].T + M[:2, 2]
+    lo = np.clip(mapped.min(axis=1), 0, [w, h])
+    hi = np.clip(mapped.max(axis=1), 0, [w, h])
+    new_bboxes = []
+    for box, (nx1, ny1), (nx2, ny2) in zip(bboxes, lo, hi):
+        if nx2 > nx1 and ny2 > ny1:
+            new_bboxes.append([box[0], (nx1 + nx2) / 2 / w, (ny1 + ny2) / 2 / h, (nx2 - nx1) / w, (ny2 - ny1) / h])
+    return new_bboxes
+
+def _to_index_frame(M: np.ndarray) -> np.ndarray:
+    # OpenCV addresses pixel centres at integer coordinates, half a pixel off the continuous frame.
+    to_index = np.array([[1, 0, -0.5], [0, 1, -0.5], [0, 0, 1]])
+    return to_index @ M @ np.linalg.inv(to_index)
+
+def compose(img: np.ndarray, bboxes: list, ops: List[str], rng=random) -> Tuple[np.ndarray, list]:
+    """
+    Applies several augmentations with one warp. `img` is never modified; the result is a new buffer.
+    Boxes pushed fully outside the image are dropped.
+    """
+    h, w = img.shape[:2]
+    ops = [op for op in COMPOSE_ORDER if op in ops]
+    M = np.eye(3)
+    for op in ops:
+        if op in GEOMETRIC_MATRIX_MAP:
+            M = GEOMETRIC_MATRIX_MAP[op](w, h, rng) @ M
+    if np.allclose(M, np.eye(3)):
+        out = img.copy()
+    else:
+        out = cv2.warpAffine(img, _to_index_frame(M)[:2], (w, h), flags=cv2.INTER_LINEAR, borderValue=(128, 128, 128))
+        bboxes = transform_bboxes(bboxes, M, w, h)
+    for op in ops:
+        if op in PHOTOMETRIC_INPLACE_MAP:
+            PHOTOMETRIC_INPLACE_MAP[op](out, rng)
+    return out, bboxes
+
+# --- Batched Composition ---
+# Works on an N x H x W x 3 stack of same-size images and an (M x 5) float bbox array
+# ([class_id, x_center, y_center, width, height]) with an (M,) array giving each box's image index.
+# Every image draws its own parameters from its own rng, in the same order as compose(), so an image
+# comes out the same whatever batch it is in. All boxes are mapped in one vectorized op, and the whole
+# stack is resampled by one cv2.remap over a vertically stacked, padded copy of the images.
+BatchResult = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+# cv2.remap addresses source pixels with 16-bit integers, so a stack is remapped in chunks below this height.
+_MAX_REMAP_ROWS = 32000
+
+def stack_bboxes(bboxes_per_image: List[list]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Converts per-image bbox lists into the (M x 5) bbox array and (M,) image index array used by `compose_batch()`.
+    Class ids are stored as floats; use the returned row indices of `compose_batch()` to recover the originals.
+    """
+    rows = [[float(v) for v in box] for boxes in bboxes_per_image for box in boxes]
+    image_idx = np.array([i for i, boxes in enumerate(bboxes_per_image) for _ in boxes], dtype=np.int64)
+    return np.array(rows, dtype=np.float64).reshape(-1, 5), image_idx
+
+def _remap_stack(images: np.ndarray, matrices: np.ndarray) -> np.ndarray:
+    """Warps image i of the stack by `matrices[i]` (continuous pixel frame), as warpAffine with a gray border would."""
+    n, h, w, c = images.shape
+    # A one-pixel gray frame around each image gives bilinear sampling at the edges the same border blend,
+    # and keeps samples from bleeding into the neighbouring image of the stack.
+    padded = np.full((n, h + 2, w + 2, c), 128, dtype=images.dtype)
+    padded[:, 1:-1, 1:-1] = images
+    grid = np.dstack(np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32)))
+    out = np.empty_like(images)
+    per_call = max(1, _MAX_REMAP_ROWS // (h + 2))
+    for start in range(0, n, per_call):
+        end = min(n, start + per_call)
+        maps = np.empty((end - start, h, w, 2), dtype=np.float32)
+        for i in range(start, end):
+            # Output pixel -> source pixel in the stacked, padded frame of this chunk.
+            row = (i - start) * (h + 2)
+            inverse = np.array([[1, 0, 1], [0, 1, 1 + row], [0, 0, 1]]) @ np.linalg.inv(_to_index_frame(matrices[i]))
+            image_map = cv2.transform(grid, inverse[:2], dst=maps[i - start])
+            # Samples that fall off this image and its frame are pushed far outside the stack, so they
+            # read the border instead of the next image.
+            outside = cv2.bitwise_not(cv2.inRange(image_map, (0, row), (w + 1, row + h + 1)))
+            cv2.add(image_map, (-1e5, -1e5, 0, 0), dst=image_map, mask=outside)
+        warped = cv2.remap(padded[start:end].reshape(-1, w + 2, c), maps.reshape(-1, w, 2), None, cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_CONSTANT, borderValue=(128, 128, 128))
+        out[start:end] = warped.reshape(end - start, h, w, c)
+    return out
+
+def compose_batch(images: np.ndarray, bboxes: np.ndarray, image_idx: np.ndarray, ops: List[List[str]],
+                  rngs: List[random.Random]) -> BatchResult:
+    """
+    Batched `compose()`: applies `ops[i]` to image i with randomness from `rngs[i]`. Returns the new stack,
+    the kept boxes, their image indices, and the rows of `bboxes` they came from (boxes pushed fully outside
+    their image are dropped). Gives the same boxes as `compose()` on each image, and pixels within 1 of its
+    (cv2.remap rounds the interpolation slightly differently from cv2.warpAffine).
+    """
+    n, h, w = images.shape[:3]
+    ops = [[op for op in COMPOSE_ORDER if op in image_ops] for image_ops in ops]
+    matrices = np.tile(np.eye(3), (n, 1, 1))
+    for i, (image_ops, rng) in enumerate(zip(ops, rngs)):
+        for op in image_ops:
+            if op in GEOMETRIC_MATRIX_MAP:
+                matrices[i] = GEOMETRIC_MATRIX_MAP[op](w, h, rng) @ matrices[i]
+    warped = ~np.all(np.isclose(matrices, np.eye(3)), axis=(1, 2))
+    out = images.copy()
+    if warped.any():
+        out[warped] = _remap_stack(images[warped], matrices[warped])
+
+    # Corners of every box through its own image's matrix; the new box is their clipped envelope.
+    new_bboxes = bboxes.astype(np.float64, copy=True)
+    x1, x2 = (bboxes[:, 1] - bboxes[:, 3] / 2) * w, (bboxes[:, 1] + bboxes[:, 3] / 2) * w
+    y1, y2 = (bboxes[:, 2] - bboxes[:, 4] / 2) * h, (bboxes[:, 2] + bboxes[:, 4] / 2) * h
+    corners = np.stack([np.stack([x1, y1], -1), np.stack([x2, y1], -1), np.stack([x1, y2], -1), np.stack([x2, y2], -1)], 1)
+    box_matrices = matrices[image_idx]
+    mapped = np.einsum("mij,mkj->mki", box_matrices[:, :2, :2], corners) + box_matrices[:, None, :2, 2]
+    lo = np.clip(mapped.min(axis=1), 0, [w, h])
+    hi = np.clip(mapped.max(axis=1), 0, [w, h])
+    moved = warped[image_idx]
+    new_bboxes[moved, 1:3] = (lo[moved] + hi[moved]) / 2 / [w, h]
+    new_bboxes[moved, 3:5] = (hi[moved] - lo[moved]) / [w, h]
+    keep = ~moved | np.all(hi > lo, axis=1)
+
+    for img, image_ops, rng in zip(out, ops, rngs):
+        for op in image_ops:
+            if op in PHOTOMETRIC_INPLACE_MAP:
+                PHOTOMETRIC_INPLACE_MAP[op](img, rng)
+    rows = np.flatnonzero(keep)
+    return out, new_bboxes[rows], image_idx[rows], rows
+
+# --- Decoded Source Cache ---
+class DecodedImageCache:
+    """
+    Bounded LRU cache of decoded source images and their parsed bboxes, keyed by label-file stem.
+    Eviction is driven by the total size of the cached image buffers, not the number of entries.
+    Safe to share between the reader threads of the augmentation pipeline.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, list]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, list]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, img: np.ndarray, bboxes: list) -> None:
+        if img.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[0].nbytes
+            while self._entries and self.current_bytes + img.nbytes > self.max_bytes:
+                _, (evicted_img, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_img.nbytes
+                self.evictions += 1
+            self._entries[key] = (img, bboxes)
+            self.current_bytes += img.nbytes
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "entries": len(self._entries), "bytes": self.current_bytes, "max_bytes": self.max_bytes
+        }
+
+def _kept_bboxes(aug_bboxes: list) -> list:
+    # Centres are clamped into the image and boxes that became too small are dropped.
+    kept_bboxes = []
+    for box in aug_bboxes:
+        box_class, x, y, w, h = box
+        x, y = max(0.0, min(1.0, x)), max(0.0, min(1.0, y))
+        if w > 0.01 and h > 0.01:
+            kept_bboxes.append([box_class, x, y, w, h])
+    return kept_bboxes
 
+def _write_sample(image_path: Path, labels: LabelWriteBuffer, name_stem: str, aug_img: np.ndarray,
+                  aug_bboxes: list) -> Tuple[list, int]:
+    """Saves one augmented image and queues its label file, returning the kept boxes and the bytes written."""
+    # data_dir may be hard-linked to the cleaned dataset, so never write through an existing file.
+    image_file = image_path / f"{name_stem}.jpg"
+    image_file.unlink(missing_ok=True)
+    cv2.imwrite(str(image_file), aug_img)
+    kept_bboxes = _kept_bboxes(aug_bboxes)
+    return kept_bboxes, image_file.stat().st_size + labels.add(name_stem, kept_bboxes)
+
+# --- Sampling Plan ---
+BALANCING_STRATEGIES = ("per_class", "co_occurrence")
+
+def plan_signature_counts(signatures: List[Tuple[int, ...]], sources: np.ndarray, target: int,
+                          overshoot_penalty: float = 0.5, reuse_penalty: float = 0.25) -> np.ndarray:
+    """
+    Number of samples to generate from each class signature (a set of class ids that occur together in a
+    source image; `sources[i]` images have signature i) so that every class reaches `target` images; each
+    sample adds one image to every class of its signature. Greedy weighted set cover: repeatedly takes the
+    signature covering the most classes still below target, minus `overshoot_penalty` per class it would
+    push further past it, for as long as it stays the best choice and no class it covers reaches target.
+    Reusing sources also costs: the penalty grows with the number of times each of the signature's images
+    has been copied, up to `reuse_penalty` once that reaches the fair share (the most copies per image any
+    class needs when it is drawn from all the images containing it), so samples are spread over otherwise
+    equally good signatures in proportion to their images. As `reuse_penalty` stays below
+    `overshoot_penalty`, reuse never makes the plan push another class further past target.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    sizes = np.array([len(signature) for signature in signatures], dtype=np.int64)
+    pair_signature = np.repeat(np.arange(len(signatures)), sizes)
+    pair_class = np.fromiter((c for signature in signatures for c in signature), dtype=np.int64, count=int(sizes.sum()))
+    counts = np.bincount(pair_class, weights=sources[pair_signature]).astype(np.int64)
+    # Classes without any image can't be balanced and are left out.
+    deficit = np.where(counts > 0, np.maximum(target - counts, 0), 0)
+    fair_share = max(int(np.max(-(-deficit // np.maximum(counts, 1)), initial=0)), 1)
+    planned = np.zeros(len(signatures), dtype=np.int64)
+    # Every step brings a class to target or ends with another signature scoring better.
+    while deficit.any():
+        gain = np.bincount(pair_signature, weights=deficit[pair_class] > 0, minlength=len(signatures))
+        gain[sources == 0] = 0
+        if not gain.any():
+            break
+        rounds = planned // np.maximum(sources, 1)  # copies made of every source image so far
+        base = gain - overshoot_penalty * (sizes - gain)
+        score = np.where(gain > 0, base - reuse_penalty * np.minimum(rounds / fair_share, 1), -np.inf)
+        # Best score, then the smallest signature, then the first one.
+        order = np.lexsort((np.arange(len(signatures)), sizes, -score))
+        best = order[0]
+        classes = np.array(signatures[best], dtype=np.int64)
+        step = int(deficit[classes][deficit[classes] > 0].min())
+        runner_up = score[order[1]] if len(order) > 1 else -np.inf
+        if reuse_penalty > 0 and base[best] - reuse_penalty <= runner_up:
+            # Stop after the last round of copies in which it still scores at least as well as the runner-up.
+            last_round = max(int(np.floor((base[best] - runner_up) * fair_share / reuse_penalty + 1e-9)), int(rounds[best]))
+            step = min(step, (last_round + 1) * int(sources[best]) - int(planned[best]))
+        planned[best] += step
+        deficit[classes] = np.maximum(deficit[classes] - step, 0)
+    return planned
+
+# --- THIS IS THE FINAL, CORRECT MAIN LOGIC ---
+def main(
+    data_dir: Path, seed: int, enabled_augmentations: List[str], augmentation_cap: Optional[int],
+    cache_max_bytes: int = 256 * 1024 * 1024, reader_workers: int = 1, transform_workers: int = 1,
+    writer_workers: int = 1, queue_size: int = 32, metrics: Optional[StageMetrics] = None,
+    compose_augmentations: bool = False, compose_probability: float = 0.5,
+    balancing_strategy: str = "co_occurrence", batch_size: int = 1
+) -> Dict:
+    """
+    Balances the dataset in `data_dir` in place by writing augmented copies of minority-class images.
+    By default each sample gets one augmentation. With `compose_augmentations`, each enabled augmentation is
+    included with `compose_probability` (at least one per sample) and applied through `compose()`.
+    With balancing_strategy="co_occurrence" the samples are planned with `plan_signature_counts()`, so images
+    that contain several minority classes count towards all of them; "per_class" balances each class on its own.
+    Samples move through the pipeline in batches of `batch_size`; with `compose_augmentations`, the
+    same-size images of a batch are augmented together by `compose_batch()`.
+    If `data_dir` is a packed dataset (see `shards.py`), sources are read from its shards and the new
+    samples are appended as new shards, in plan order.
+    Phase timings, per-stage busy time, byte counts and per-augmentation latency histograms are recorded
+    in `metrics` when one is given.
+    """
+    metrics = metrics or StageMetrics("augmentation")
     image_path = data_dir / 'images'
     label_path = data_dir / 'labels'
+    reader = ShardReader(data_dir) if is_packed_dataset(data_dir) else None
     
-    # --- STEP 1: COUNT IMAGES PER CLASS (THE CORRECT WAY) ---
-    image_counts_per_class: Dict[str, int] = {}
-    class_to_files: Dict[str, List[Path]] = {}
-    all_label_files = list(sorted(label_path.glob('*.txt'))) if label_path.exists() else []
-
-    for label_file in all_label_files:
-        with open(label_file, 'r') as f:
-            # Find the unique set of classes present in this one image's label file
-            classes_in_this_file = {line.strip().split()[0] for line in f if line.strip()}
-        
-        for class_id in classes_in_this_file:
-            # Increment the image count for each class found
-            image_counts_per_class[class_id] = image_counts_per_class.get(class_id, 0) + 1
-            # Associate this file with the class
-            if class_id not in class_to_files:
-                class_to_files[class_id] = []
-            class_to_files[class_id].append(label_file)
+    # --- STEP 1: INDEX THE LABELS AND COUNT IMAGES PER CLASS ---
+    # Every label file is parsed exactly once; counting, sampling and the final report all use the index.
+    with metrics.phase("index"):
+        if reader is not None:
+            packed_idx = {name: i for i, name in enumerate(reader.names)}
+            index = LabelIndex.build(label_path, texts=(
+                (name, reader.label_text(i)) for i, name in enumerate(reader.names) if reader.is_labeled(i)
+            ))
+        else:
+            index = LabelIndex.build(label_path)
+        image_counts_per_class = index.image_counts_per_class()
 
     if not image_counts_per_class:
         return {"error": "Dataset has no labels to augment."}
@@ -101,48 +395,205 @@ def main(data_dir: Path, seed: int, enabled_augmentations: List[str], augmentati
 
     available_augs = [aug for aug in enabled_augmentations if aug in AUGMENTATION_MAP]
     if not available_augs: return {"error": "No valid augmentations were selected."}
+    if balancing_strategy not in BALANCING_STRATEGIES:
+        return {"error": f"Unknown balancing strategy: {balancing_strategy}"}
+
+    # --- STEP 2: PLAN EVERY SAMPLE UP FRONT ---
+    # Sources and augmentations are drawn from one seeded stream, and each sample gets its own RNG seed,
+    # so the generated files depend only on `seed`, not on worker counts or completion order.
+    plan_rng = random.Random(seed)
+    samples = []
+    source_bboxes: Dict[int, list] = {}
+    def add_sample(source_idx: int, name: str) -> None:
+        if source_idx not in source_bboxes:
+            source_bboxes[source_idx] = index.bboxes(source_idx)
+        if compose_augmentations:
+            ops = [aug for aug in available_augs if plan_rng.random() < compose_probability]
+            ops = ops or [plan_rng.choice(available_augs)]
+        else:
+            ops = [plan_rng.choice(available_augs)]
+        samples.append({
+            "position": len(samples), "source_idx": source_idx, "ops": ops,
+            "name": name, "seed": plan_rng.getrandbits(64),
+        })
+
+    with metrics.phase("plan"):
+        signatures, file_signature = index.class_signatures()
+        class_counts = np.array([image_counts_per_class.get(name, 0) for name in index.class_names], dtype=np.int64)
+        if balancing_strategy == "co_occurrence":
+            signature_sources = np.bincount(file_signature[file_signature >= 0], minlength=len(signatures))
+            planned = plan_signature_counts(signatures, signature_sources, target_count)
+            # Each signature's samples cycle through its source images in a seeded order, so sources are used evenly.
+            by_signature = np.argsort(file_signature, kind="stable")
+            bounds = np.searchsorted(file_signature[by_signature], np.arange(len(signatures) + 1))
+            for signature, count in enumerate(planned.tolist()):
+                sources = by_signature[bounds[signature]:bounds[signature + 1]].tolist()
+                plan_rng.shuffle(sources)
+                for i in range(count):
+                    source_idx = sources[i % len(sources)]
+                    add_sample(source_idx, f"{index.stems[source_idx]}_aug_{i // len(sources)}")
+        else:
+            for class_id, count in image_counts_per_class.items():
+                needed = target_count - count
+                if needed <= 0: continue
+
+                source_files = index.files_for_class(class_id)
+                if len(source_files) == 0: continue
+
+                for i in range(needed):
+                    source_idx = int(plan_rng.choice(source_files))
+                    add_sample(source_idx, f"{index.stems[source_idx]}_aug_{class_id}_{i}")
+
+        # Counts if every sample keeps all the classes of its source; augmentations that crop boxes away fall short.
+        planned_counts = class_counts.copy()
+        sample_signatures = np.bincount(file_signature[[sample["source_idx"] for sample in samples]].astype(np.int64),
+                                        minlength=len(signatures))
+        for signature, count in zip(signatures, sample_signatures.tolist()):
+            planned_counts[list(signature)] += count
+        planned_image_counts = {name: int(count) for name, count in zip(index.class_names, planned_counts)}
+    metrics.total = len(samples)
+
+    # --- STEP 3: DECODE -> AUGMENT -> ENCODE/WRITE PIPELINE ---
+    # Minority classes draw from a small pool of sources, so decoded images are reused across draws.
+    cache = DecodedImageCache(cache_max_bytes)
+
+    # The busy time of each stage (summed over its threads) shows whether a run is bound by decode, augment or write.
+    # A sample that cannot be read or encoded travels on as `(sample, None, None)`, so packed output can
+    # skip its position instead of waiting for it.
+    def read_sample(sample: Dict):
+        source_stem = index.stems[sample["source_idx"]]
+        cached = cache.get(source_stem)
+        if cached is None:
+            with metrics.phase("decode", per_thread=True):
+                if reader is not None:
+                    data = reader.read_bytes(packed_idx[source_stem])
+                    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+                    if img is None: return sample, None, None
+                    metrics.add("bytes_read", len(data))
+                else:
+                    source_file = image_path / (source_stem + '.jpg')
+                    img = cv2.imread(str(source_file))
+                    if img is None: return sample, None, None
+                    metrics.add("bytes_read", source_file.stat().st_size)
+            cached = (img, source_bboxes[sample["source_idx"]])
+            cache.put(source_stem, *cached)
+        return sample, *cached
+
+    def transform_sample(item: tuple):
+        sample, img, bboxes = item
+        if img is None: return item
+        rng = random.Random(sample["seed"])
+        with metrics.phase("augment", per_thread=True):
+            started = time.perf_counter()
+            if compose_augmentations:
+                # compose() writes into a fresh buffer, so the cached source needs no copy.
+                aug_img, aug_bboxes = compose(img, bboxes, sample["ops"], rng)
+            else:
+                aug_img, aug_bboxes = AUGMENTATION_MAP[sample["ops"][0]](img.copy(), bboxes, rng)
+            metrics.observe("compose" if compose_augmentations else sample["ops"][0], time.perf_counter() - started)
+        return sample, aug_img, aug_bboxes
+
+    def transform_group(items: List[tuple]) -> List[tuple]:
+        # One compose_batch() call for same-size images; each gets its share of the time as its latency.
+        images = np.stack([img for _, img, _ in items])
+        bboxes, image_idx = stack_bboxes([boxes for _, _, boxes in items])
+        with metrics.phase("augment", per_thread=True):
+            started = time.perf_counter()
+            aug_images, aug_bboxes, aug_idx, rows = compose_batch(
+                images, bboxes, image_idx, [sample["ops"] for sample, _, _ in items],
+                [random.Random(sample["seed"]) for sample, _, _ in items])
+            elapsed = time.perf_counter() - started
+        for _ in items:
+            metrics.observe("compose", elapsed / len(items))
+        classes = [box[0] for _, _, boxes in items for box in boxes]
+        per_image: List[list] = [[] for _ in items]
+        for box, i, row in zip(aug_bboxes.tolist(), aug_idx.tolist(), rows.tolist()):
+            per_image[i].append([classes[row]] + box[1:])
+        return [(sample, aug_img, boxes) for (sample, _, _), aug_img, boxes in zip(items, aug_images, per_image)]
+
+    def transform(batch: List[tuple]) -> List[tuple]:
+        # With batching on, every image goes through compose_batch(), so the output doesn't depend on how the
+        # images happened to be grouped.
+        if not compose_augmentations or batch_size == 1:
+            return [transform_sample(item) for item in batch]
+        groups: Dict[tuple, List[int]] = {}
+        for position, (_, img, _) in enumerate(batch):
+            if img is not None:
+                groups.setdefault(img.shape, []).append(position)
+        results = list(batch)
+        for positions in groups.values():
+            group = [batch[position] for position in positions]
+            for position, output in zip(positions, transform_group(group)):
+                results[position] = output
+        return results
+
+    def write_sample(item: tuple):
+        sample, aug_img, aug_bboxes = item
+        if aug_img is None: return item
+        with metrics.phase("encode_write", per_thread=True):
+            if reader is not None:
+                # Packed output is only encoded here; the main thread appends it to the shards in plan order.
+                ok, encoded = cv2.imencode(".jpg", aug_img)
+                if not ok: return sample, None, None
+                metrics.add("bytes_written", len(encoded))
+                return sample, _kept_bboxes(aug_bboxes), encoded.tobytes()
+            kept_bboxes, written = _write_sample(image_path, label_writer, sample["name"], aug_img, aug_bboxes)
+            metrics.add("bytes_written", written)
+        return sample, kept_bboxes, None
+
+    def read(batch: List[Dict]) -> List[tuple]:
+        return [read_sample(sample) for sample in batch]
+
+    def write(batch: List[tuple]) -> List[tuple]:
+        return [write_sample(item) for item in batch]
+
+    batch_size = max(1, batch_size)
+    batches = [samples[start:start + batch_size] for start in range(0, len(samples), batch_size)]
+    stages = [(read, max(1, reader_workers)), (transform, max(1, transform_workers)), (write, max(1, writer_workers))]
+    writer = ShardWriter(data_dir, append=True) if reader is not None else None
+    # Label files of new samples are written in batches in the background; see `label_io.py`.
+    label_writer = LabelWriteBuffer(label_path) if reader is None else None
+    pending: Dict[int, Optional[tuple]] = {}
+    next_position = 0
+    try:
+        with metrics.phase("pipeline"):
+            # queue_size still bounds the number of samples waiting between two stages.
+            for results in run_pipeline(batches, stages, max(1, queue_size // batch_size)):
+                for sample, kept_bboxes, encoded in results:
+                    dropped = kept_bboxes is None
+                    if not dropped:
+                        index.add(sample["name"], kept_bboxes)
+                        total_augmentations_applied += 1
+                        metrics.add("images_processed")
+                    if writer is not None:
+                        # Packed output is appended in plan order; a dropped sample only frees its position.
+                        pending[sample["position"]] = None if dropped else (sample["name"], encoded, kept_bboxes)
+                        while next_position in pending:
+                            entry = pending.pop(next_position)
+                            if entry is not None:
+                                writer.add(*entry)
+                            next_position += 1
 
-    # --- STEP 2: AUGMENT BASED ON IMAGE COUNT ---
-    for class_id, count in image_counts_per_class.items():
-        needed = target_count - count
-        if needed <= 0: continue
-        
-        source_files = class_to_files.get(class_id, [])
-        if not source_files: continue
-        
-        for i in range(needed):
-            source_label_file = random.choice(source_files)
-            source_img_file = image_path / (source_label_file.stem + '.jpg')
-            img = cv2.imread(str(source_img_file))
-            if img is None: continue
-
-            with open(source_label_file, 'r') as f:
-                bboxes = [[parts[0]] + [float(p) for p in parts[1:]] for line in f if (parts := line.strip().split())]
-
-            aug_func = AUGMENTATION_MAP[random.choice(available_augs)]
-            aug_img, aug_bboxes = aug_func(img.copy(), bboxes)
-
-            aug_name_stem = f"{source_label_file.stem}_aug_{class_id}_{i}"
-            cv2.imwrite(str(image_path / f"{aug_name_stem}.jpg"), aug_img)
-            with open(label_path / f"{aug_name_stem}.txt", 'w') as f_out:
-                for box in aug_bboxes:
-                    box_class, x, y, w, h = box
-                    x, y = max(0.0, min(1.0, x)), max(0.0, min(1.0, y))
-                    if w > 0.01 and h > 0.01:
-                        f_out.write(f"{box_class} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n")
-            total_augmentations_applied += 1
-
-    # --- STEP 3: RECALCULATE FINAL IMAGE COUNTS ---
-    final_counts: Dict[str, int] = {}
-    for label_file in sorted(label_path.glob('*.txt')):
-        with open(label_file, 'r') as f:
-            classes_in_this_file = {line.strip().split()[0] for line in f if line.strip()}
-        for class_id in classes_in_this_file:
-            final_counts[class_id] = final_counts.get(class_id, 0) + 1
+        # --- STEP 4: FINAL IMAGE COUNTS FROM THE UPDATED INDEX ---
+        with metrics.phase("finalize"):
+            if writer is not None:
+                writer.close()
+            if label_writer is not None:
+                label_writer.flush()
+            final_counts = index.image_counts_per_class()
+    finally:
+        if reader is not None:
+            reader.close()
+        if label_writer is not None:
+            label_writer.close()
 
     report = {
         "initial_image_counts": initial_counts,
+        "planned_image_counts": planned_image_counts,
         "final_image_counts": final_counts,
-        "total_augmentations_applied": total_augmentations_applied
+        "balancing_strategy": balancing_strategy,
+        "planned_augmentations": len(samples),
+        "total_augmentations_applied": total_augmentations_applied,
+        "source_cache": cache.stats()
     }
-    return report
\ No newline at end of file
+    return report
@@ -0,0 +1,135 @@
+import hashlib
+import itertools
+import math
+from typing import Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+
+HASH_BITS = 64
+
+def _to_gray(img: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def dhash(img: np.ndarray) -> int:
+    """64-bit difference hash: whether each pixel of a 9x8 thumbnail is brighter than its left neighbour."""
+    small = cv2.resize(_to_gray(img), (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+def phash(img: np.ndarray) -> int:
+    """64-bit perceptual hash: signs of the 8x8 lowest DCT frequencies of a 32x32 thumbnail against their median."""
+    small = cv2.resize(_to_gray(img), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    return _bits_to_int(low > np.median(low[1:]))
+
+def pixel_hash(img: np.ndarray) -> str:
+    """Hash of the decoded pixels, so the same picture saved twice (or re-encoded losslessly) matches exactly."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(img.shape).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.hexdigest()
+
+class MultiIndexHash:
+    """
+    Index of 64-bit hashes answering "which stored hash is within `max_distance` bits of this one?"
+    without comparing against every entry. Hashes are cut into `m` bands; by the pigeonhole principle
+    a hash within `max_distance` differs from a match by at most `max_distance // m` bits in at least
+    one band, so a lookup probes every band value within that radius and compares only the entries
+    found there. Narrow bands fill up as the index grows and wide ones need many probes, so the band
+    layout is chosen from the number of stored hashes (see `_plan_bands`) and rebuilt as it grows:
+    a small index uses narrow bands that must match exactly, a large one wider bands probed one or two
+    bits away. Lookups stay far cheaper than a full scan, though their cost still grows slowly with size.
+    """
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self._hashes: List[int] = []
+        self._layout(_plan_bands(max_distance, 1024))
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _layout(self, plan: Tuple[int, int]) -> None:
+        num_bands, radius = plan
+        bounds = [round(i * HASH_BITS / num_bands) for i in range(num_bands + 1)]
+        self._plan = plan
+        self._bands = [(HASH_BITS - end, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        # XOR masks of every band value within `radius` bits, per band.
+        self._probes = [[sum(1 << bit for bit in bits) for k in range(radius + 1)
+                         for bits in itertools.combinations(range(end - start), k)]
+                        for start, end in zip(bounds, bounds[1:])]
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+        for entry, value in enumerate(self._hashes):
+            self._insert(entry, value)
+        self._replan_at = 2 * max(len(self._hashes), 1024)
+
+    def _insert(self, entry: int, value: int) -> None:
+        for (shift, mask), table in zip(self._bands, self._tables):
+            table.setdefault((value >> shift) & mask, []).append(entry)
+
+    def add(self, value: int) -> int:
+        """Stores a hash and returns its id (ids count up from 0)."""
+        entry = len(self._hashes)
+        self._hashes.append(value)
+        self._insert(entry, value)
+        if len(self._hashes) >= self._replan_at:
+            # Planned for the size halfway to the next check.
+            plan = _plan_bands(self.max_distance, 3 * len(self._hashes))
+            if plan != self._plan:
+                self._layout(plan)
+            self._replan_at = 2 * len(self._hashes)
+        return entry
+
+    def query(self, value: int) -> List[Tuple[int, int]]:
+        """Returns `(distance, id)` for every stored hash within `max_distance`, closest first."""
+        candidates = set()
+        for (shift, mask), table, probes in zip(self._bands, self._tables, self._probes):
+            key = (value >> shift) & mask
+            for bucket in map(table.get, [key ^ probe for probe in probes]):
+                if bucket:
+                    candidates.update(bucket)
+        hashes, limit = self._hashes, self.max_distance
+        matches = [(distance, entry) for entry in candidates
+                   if (distance := (hashes[entry] ^ value).bit_count()) <= limit]
+        return sorted(matches)
+
+def _plan_bands(max_distance: int, size: int) -> Tuple[int, int]:
+    """
+    `(number of bands, probe radius)` with the lowest expected lookup cost for `size` random hashes:
+    the band values probed plus the entries expected to share them.
+    """
+    def cost(num_bands: int) -> float:
+        width, radius = HASH_BITS // num_bands, max_distance // num_bands
+        probes = sum(math.comb(width, k) for k in range(radius + 1))
+        return num_bands * probes * (1 + size / 2 ** width)
+    num_bands = min(range(1, min(max_distance + 1, HASH_BITS) + 1), key=cost)
+    return num_bands, max_distance // num_bands
+
+class DuplicateIndex:
+    """
+    Finds exact duplicates (same content hash) and near duplicates (pHash and dHash both within
+    `max_distance` bits) of images added so far. Near-duplicate candidates come from a
+    `MultiIndexHash` over the pHash, and are confirmed with the dHash.
+    """
+    def __init__(self, max_distance: int):
+        self._exact: Dict[str, str] = {}
+        self._near = MultiIndexHash(max_distance)
+        self._names: List[str] = []
+        self._dhashes: List[int] = []
+
+    def find(self, content_hash: str, p_hash: int, d_hash: int) -> Optional[Tuple[str, str]]:
+        """Returns `("exact" | "near", name_of_original)` if the image duplicates one already added."""
+        original = self._exact.get(content_hash)
+        if original is not None:
+            return "exact", original
+        for _, entry in self._near.query(p_hash):
+            if (self._dhashes[entry] ^ d_hash).bit_count() <= self._near.max_distance:
+                return "near", self._names[entry]
+        return None
+
+    def add(self, name: str, content_hash: str, p_hash: int, d_hash: int) -> None:
+        self._exact.setdefault(content_hash, name)
+        self._near.add(p_hash)
+        self._names.append(name)
+        self._dhashes.append(d_hash)
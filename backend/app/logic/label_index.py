@@ -0,0 +1,138 @@
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from .label_io import read_label_texts
+
+class LabelIndex:
+    """
+    Compact in-memory index of a YOLO `labels/` folder.
+    The boxes of all label files are stored back to back in flat typed arrays: file `i` owns
+    rows `offsets[i]:offsets[i + 1]` of `class_ids` (int32) and `boxes` (float32, x/y/w/h).
+    Class tokens from the label files are interned to small integer ids, so per-class counting
+    and sampling are NumPy operations instead of dicts of lists of `Path` objects.
+    """
+    def __init__(self):
+        self.stems: List[str] = []
+        self.class_names: List[str] = []
+        self._class_lookup: Dict[str, int] = {}
+        self._offsets = array('q', [0])
+        self._class_ids = array('i')
+        self._boxes = array('f')
+
+    @classmethod
+    def build(cls, label_dir: Path, texts: Optional[Iterable[Tuple[str, str]]] = None) -> "LabelIndex":
+        """
+        Indexes every `*.txt` file in `label_dir` in sorted order, reading each file once (several
+        at a time, see `label_io.py`). `texts` can supply already-read (stem, text) pairs in that order instead.
+        """
+        index = cls()
+        if texts is None:
+            texts = read_label_texts(label_dir)
+        for stem, text in texts:
+            index.add_text(stem, text)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.stems)
+
+    @property
+    def num_boxes(self) -> int:
+        return len(self._class_ids)
+
+    def _class_id(self, token: str) -> int:
+        class_id = self._class_lookup.get(token)
+        if class_id is None:
+            class_id = self._class_lookup[token] = len(self.class_names)
+            self.class_names.append(token)
+        return class_id
+
+    def add_text(self, stem: str, text: str) -> int:
+        """Parses YOLO label text (`class x y w h` per line) and appends it as a new file. Returns its index."""
+        class_tokens, coords = [], []
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            try:
+                values = [float(p) for p in parts[1:5]]
+            except ValueError:
+                continue
+            class_tokens.append(parts[0])
+            coords.extend(values)
+        return self._append(stem, [self._class_id(t) for t in class_tokens], coords)
+
+    def add(self, stem: str, bboxes: List[list]) -> int:
+        """Appends a file from boxes in the `[class_id, x, y, w, h]` list format. Returns its index."""
+        class_ids = [self._class_id(str(box[0])) for box in bboxes]
+        coords = [float(v) for box in bboxes for v in box[1:5]]
+        return self._append(stem, class_ids, coords)
+
+    def _append(self, stem: str, class_ids: List[int], coords: List[float]) -> int:
+        self.stems.append(stem)
+        self._class_ids.extend(class_ids)
+        self._boxes.extend(coords)
+        self._offsets.append(len(self._class_ids))
+        return len(self.stems) - 1
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return np.frombuffer(self._offsets, dtype=np.int64)
+
+    @property
+    def class_ids(self) -> np.ndarray:
+        return np.frombuffer(self._class_ids, dtype=np.int32)
+
+    @property
+    def boxes(self) -> np.ndarray:
+        return np.frombuffer(self._boxes, dtype=np.float32).reshape(-1, 4)
+
+    def bboxes(self, file_idx: int) -> List[list]:
+        """Boxes of one file in the `[class_id, x, y, w, h]` list format used by the augmentation functions."""
+        start, end = self._offsets[file_idx], self._offsets[file_idx + 1]
+        boxes = self.boxes[start:end].tolist()
+        return [[self.class_names[c]] + box for c, box in zip(self._class_ids[start:end], boxes)]
+
+    def _file_class_pairs(self) -> np.ndarray:
+        # Unique (file, class) combinations encoded as file * num_classes + class.
+        num_classes = max(1, len(self.class_names))
+        file_idx = np.repeat(np.arange(len(self.stems), dtype=np.int64), np.diff(self.offsets))
+        return np.unique(file_idx * num_classes + self.class_ids)
+
+    def image_counts_per_class(self) -> Dict[str, int]:
+        """Number of files containing at least one box of each class."""
+        num_classes = max(1, len(self.class_names))
+        counts = np.bincount(self._file_class_pairs() % num_classes, minlength=len(self.class_names))
+        return {name: int(counts[i]) for i, name in enumerate(self.class_names) if counts[i] > 0}
+
+    def class_signatures(self) -> Tuple[List[Tuple[int, ...]], np.ndarray]:
+        """
+        The distinct sets of class ids that occur together in a file (sorted tuples), and for every file
+        the number of its set in that list (-1 for files without boxes).
+        """
+        num_classes = max(1, len(self.class_names))
+        pairs = self._file_class_pairs()
+        files, class_ids = pairs // num_classes, pairs % num_classes
+        starts = np.flatnonzero(np.r_[True, files[1:] != files[:-1]]) if len(pairs) else np.empty(0, dtype=np.int64)
+        ends = np.r_[starts[1:], len(pairs)]
+        signatures: List[Tuple[int, ...]] = []
+        lookup: Dict[Tuple[int, ...], int] = {}
+        file_signature = np.full(len(self.stems), -1, dtype=np.int64)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            key = tuple(class_ids[start:end].tolist())
+            signature = lookup.get(key)
+            if signature is None:
+                signature = lookup[key] = len(signatures)
+                signatures.append(key)
+            file_signature[files[start]] = signature
+        return signatures, file_signature
+
+    def files_for_class(self, class_name: str) -> np.ndarray:
+        """Sorted indices of the files that contain the given class."""
+        class_id = self._class_lookup.get(class_name)
+        if class_id is None:
+            return np.empty(0, dtype=np.int64)
+        num_classes = max(1, len(self.class_names))
+        pairs = self._file_class_pairs()
+        return pairs[pairs % num_classes == class_id] // num_classes
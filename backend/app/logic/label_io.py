@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+# Label files are tiny, so reading or writing one costs a few syscalls of latency, not CPU.
+# On network-mounted storage that latency dominates, and only overlapping many requests hides it.
+DEFAULT_IO_WORKERS = 16
+DEFAULT_WRITE_BATCH = 64
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+def list_label_files(label_dir: Path) -> Dict[str, Path]:
+    """`*.txt` files in `label_dir` by stem, sorted by name, from a single `os.scandir` pass."""
+    if not label_dir.exists():
+        return {}
+    with os.scandir(label_dir) as entries:
+        names = sorted(e.name for e in entries if e.name.endswith(".txt") and e.is_file())
+    return {name[:-4]: label_dir / name for name in names}
+
+def prefetch(items: Iterable[T], read: Callable[[T], R], workers: int = DEFAULT_IO_WORKERS) -> Iterator[Tuple[T, R]]:
+    """
+    Yields `(item, read(item))` in input order while up to `2 * workers` reads run ahead on a thread pool.
+    Exceptions from `read` are raised when their item is reached, as in a plain loop.
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, read(item)
+        return
+    window = 2 * workers
+    with ThreadPoolExecutor(workers, thread_name_prefix="label-read") as pool:
+        pending: Deque[Tuple[T, Future]] = deque()
+        for item in items:
+            pending.append((item, pool.submit(read, item)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+def _read_optional(path: Optional[Path]) -> Optional[bytes]:
+    return path.read_bytes() if path is not None else None
+
+def read_label_bytes(paths: Iterable[Optional[Path]], workers: int = DEFAULT_IO_WORKERS) -> Iterator[Optional[bytes]]:
+    """Contents of each label file in order (None for a None path), read concurrently."""
+    return (data for _, data in prefetch(paths, _read_optional, workers))
+
+def read_label_texts(label_dir: Path, workers: int = DEFAULT_IO_WORKERS) -> Iterator[Tuple[str, str]]:
+    """`(stem, text)` for every label file in `label_dir`, in sorted order, read concurrently."""
+    files = list_label_files(label_dir)
+    return ((stem, data.decode()) for stem, data in zip(files, read_label_bytes(files.values(), workers)))
+
+def format_labels(bboxes: List[list]) -> str:
+    """YOLO label text for boxes in the `[class_id, x, y, w, h]` list format."""
+    return "".join(f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for c, x, y, w, h in bboxes)
+
+class LabelWriteBuffer:
+    """
+    Collects label files and writes them to `label_dir` in batches on a background thread pool, so callers
+    never wait on per-file latency. The files are the same as writing each one directly; they are complete
+    once `close()` (or `flush()`) returns, which also re-raises any write error. Safe to share between threads.
+    """
+    def __init__(self, label_dir: Path, batch_size: int = DEFAULT_WRITE_BATCH, workers: int = DEFAULT_IO_WORKERS):
+        self.label_dir = Path(label_dir)
+        self.batch_size = max(1, batch_size)
+        self._batch: List[Tuple[str, bytes]] = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix="label-write")
+        self._in_flight: Deque[Future] = deque()
+        self._max_in_flight = 2 * max(1, workers)
+
+    def add(self, stem: str, bboxes: List[list]) -> int:
+        """Queues `labels/<stem>.txt` with the given boxes and returns its size in bytes."""
+        data = format_labels(bboxes).encode()
+        with self._lock:
+            self._batch.append((stem, data))
+            if len(self._batch) >= self.batch_size:
+                self._submit()
+        return len(data)
+
+    def _submit(self) -> None:
+        # Called with the lock held. Bounds the queued batches so a slow disk applies back-pressure.
+        batch, self._batch = self._batch, []
+        while len(self._in_flight) >= self._max_in_flight:
+            self._in_flight.popleft().result()
+        self._in_flight.append(self._pool.submit(self._write_batch, batch))
+
+    def _write_batch(self, batch: List[Tuple[str, bytes]]) -> None:
+        for stem, data in batch:
+            path = self.label_dir / f"{stem}.txt"
+            # The folder may be hard-linked to another dataset, so never write through an existing file.
+            path.unlink(missing_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def flush(self) -> None:
+        """Writes everything queued so far and waits for it."""
+        with self._lock:
+            if self._batch:
+                self._submit()
+            in_flight, self._in_flight = self._in_flight, deque()
+        for future in in_flight:
+            future.result()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown()
+
+    def __enter__(self) -> "LabelWriteBuffer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
@@ -0,0 +1,193 @@
+import re
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _process_cpu_seconds() -> float:
+    # Includes reaped child processes, so a phase that runs and joins a multiprocessing Pool counts its workers.
+    cpu = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += children.ru_utime + children.ru_stime
+    return cpu
+
+class StageMetrics:
+    """
+    Thread-safe timings and counters for one run of a pipeline stage (cleaning, augmentation, export).
+
+    - `phase(name)` accumulates wall and CPU time of a block. Top-level phases use process CPU time;
+      with `per_thread=True` the block's own thread CPU time is used instead, so busy time of worker
+      threads (decode, augment, write) adds up across threads.
+    - `add(name, n)` bumps a counter such as `images_processed`, `bytes_read` or `bytes_written`.
+    - `observe(name, seconds)` records a latency in a fixed-bucket histogram.
+
+    `on_progress` receives `snapshot()` at most every `interval` seconds while counters move, and once more
+    from `finish()`.
+    """
+    def __init__(
+        self, stage: str, total: Optional[int] = None,
+        on_progress: Optional[Callable[[Dict], None]] = None, interval: float = 1.0
+    ):
+        self.stage = stage
+        self.total = total
+        self.on_progress = on_progress
+        self.interval = interval
+        self.current_phase: Optional[str] = None
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._last_report = self._started
+        self._reporting = False
+        self._phases: Dict[str, Dict[str, float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._histograms: Dict[str, Dict] = {}
+
+    @contextmanager
+    def phase(self, name: str, per_thread: bool = False) -> Iterator[None]:
+        cpu_clock = time.thread_time if per_thread else _process_cpu_seconds
+        if not per_thread:
+            self.current_phase = name
+        wall_start, cpu_start = time.perf_counter(), cpu_clock()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, cpu_clock() - cpu_start
+            with self._lock:
+                entry = self._phases.setdefault(name, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "calls": 0})
+                entry["wall_seconds"] += wall
+                entry["cpu_seconds"] += cpu
+                entry["calls"] += 1
+
+    def add(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+        self._maybe_report()
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = {"counts": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0, "sum": 0.0}
+            hist["counts"][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            hist["count"] += 1
+            hist["sum"] += seconds
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            done = self._counters.get("images_processed", 0)
+            return {
+                "stage": self.stage,
+                "phase": self.current_phase,
+                "done": done,
+                "total": self.total,
+                "percent": round(100 * done / self.total, 1) if self.total else None,
+                "elapsed_seconds": round(time.perf_counter() - self._started, 3),
+                "phases": {
+                    name: {"wall_seconds": round(p["wall_seconds"], 4), "cpu_seconds": round(p["cpu_seconds"], 4), "calls": p["calls"]}
+                    for name, p in self._phases.items()
+                },
+                "counters": dict(self._counters),
+                "histograms": {
+                    name: {"buckets": list(LATENCY_BUCKETS), "counts": list(h["counts"]), "count": h["count"], "sum": round(h["sum"], 6)}
+                    for name, h in self._histograms.items()
+                },
+            }
+
+    def _maybe_report(self) -> None:
+        if self.on_progress is None or time.perf_counter() - self._last_report < self.interval:
+            return
+        with self._lock:
+            # Only one thread reports at a time; the others carry on instead of queueing up behind it.
+            if self._reporting:
+                return
+            self._reporting = True
+            self._last_report = time.perf_counter()
+        try:
+            self.on_progress(self.snapshot())
+        finally:
+            self._reporting = False
+
+    def finish(self) -> Dict:
+        self.current_phase = None
+        snapshot = self.snapshot()
+        if self.on_progress is not None:
+            self.on_progress(snapshot)
+        return snapshot
+
+# --- Prometheus text exposition ---
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def render_prometheus(records: Iterable[Dict], queue: Dict, startup: Optional[Dict] = None) -> str:
+    """
+    Renders job counts, queue depth and the `*_metrics` snapshots stored on job records in the
+    Prometheus text format. Timings, counters and histograms are summed over all jobs per stage.
+    `startup` adds the API process's import/startup times and which heavy modules it has loaded.
+    """
+    statuses: Dict[str, int] = {}
+    phases: Dict[tuple, List[float]] = {}
+    counters: Dict[tuple, int] = {}
+    histograms: Dict[tuple, Dict] = {}
+    for record in records:
+        statuses[record.get("status", "unknown")] = statuses.get(record.get("status", "unknown"), 0) + 1
+        for key, snap in record.items():
+            if not key.endswith("_metrics") or not isinstance(snap, dict):
+                continue
+            stage = snap.get("stage", key[:-len("_metrics")])
+            for name, p in snap.get("phases", {}).items():
+                totals = phases.setdefault((stage, name), [0.0, 0.0])
+                totals[0] += p["wall_seconds"]
+                totals[1] += p["cpu_seconds"]
+            for name, value in snap.get("counters", {}).items():
+                counters[(_metric_name(name), stage)] = counters.get((_metric_name(name), stage), 0) + value
+            for name, h in snap.get("histograms", {}).items():
+                total = histograms.setdefault((stage, name), {"counts": [0] * len(h["counts"]), "count": 0, "sum": 0.0, "buckets": h["buckets"]})
+                total["counts"] = [a + b for a, b in zip(total["counts"], h["counts"])]
+                total["count"] += h["count"]
+                total["sum"] += h["sum"]
+
+    lines = ["# HELP dataset_jobs Jobs by status.", "# TYPE dataset_jobs gauge"]
+    lines += [f'dataset_jobs{{status="{_label_value(s)}"}} {n}' for s, n in sorted(statuses.items())]
+    lines += ["# TYPE dataset_jobs_queued gauge", f"dataset_jobs_queued {queue.get('depth', 0)}",
+              "# TYPE dataset_jobs_running gauge", f"dataset_jobs_running {queue.get('running', 0)}"]
+
+    lines += ["# HELP dataset_phase_wall_seconds_total Wall time spent per stage phase.", "# TYPE dataset_phase_wall_seconds_total counter"]
+    lines += [f'dataset_phase_wall_seconds_total{{stage="{_label_value(s)}",phase="{_label_value(p)}"}} {t[0]:.6f}' for (s, p), t in sorted(phases.items())]
+    lines += ["# HELP dataset_phase_cpu_seconds_total CPU time spent per stage phase.", "# TYPE dataset_phase_cpu_seconds_total counter"]
+    lines += [f'dataset_phase_cpu_seconds_total{{stage="{_label_value(s)}",phase="{_label_value(p)}"}} {t[1]:.6f}' for (s, p), t in sorted(phases.items())]
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE dataset_{name}_total counter")
+        lines += [f'dataset_{name}_total{{stage="{_label_value(s)}"}} {v}' for (n, s), v in sorted(counters.items()) if n == name]
+
+    lines += ["# HELP dataset_latency_seconds Per-item latency of a stage operation.", "# TYPE dataset_latency_seconds histogram"]
+    for (stage, name), h in sorted(histograms.items()):
+        labels = f'stage="{_label_value(stage)}",name="{_label_value(name)}"'
+        cumulative = 0
+        for bound, count in zip(list(h["buckets"]) + ["+Inf"], h["counts"]):
+            cumulative += count
+            lines.append(f'dataset_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"dataset_latency_seconds_sum{{{labels}}} {h['sum']:.6f}")
+        lines.append(f"dataset_latency_seconds_count{{{labels}}} {h['count']}")
+
+    if startup is not None:
+        for key in ("import_seconds", "startup_seconds"):
+            if startup.get(key) is not None:
+                lines += [f"# TYPE dataset_api_{key} gauge", f"dataset_api_{key} {startup[key]:.6f}"]
+        lines += ["# HELP dataset_api_heavy_module_loaded Whether the API process has imported a module only job workers need.",
+                  "# TYPE dataset_api_heavy_module_loaded gauge"]
+        lines += [f'dataset_api_heavy_module_loaded{{module="{_label_value(m)}"}} {int(loaded)}'
+                  for m, loaded in sorted(startup.get("heavy_modules", {}).items())]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,96 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Sequence, Tuple
+
+# Queue marker telling a worker that its stage has no more input.
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+Stage = Tuple[Callable[[Any], Any], int]
+
+def run_pipeline(items: Iterable, stages: Sequence[Stage], queue_size: int = 32) -> Iterator:
+    """
+    Streams `items` through a chain of stages, each run by its own pool of threads.
+    Stages are connected by bounded queues, so at most about `queue_size` items wait between two
+    stages and a slow stage applies back-pressure to the ones before it. OpenCV and file I/O release
+    the GIL, so decode, transform and encode/write stages genuinely overlap.
+
+    `stages` is a list of `(func, num_workers)`. A stage returning None drops the item.
+    Results of the last stage are yielded as they complete, in no particular order.
+    The first exception raised by any stage is re-raised in the caller.
+    """
+    queues: List[queue.Queue] = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def put(q: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def fail(error: BaseException) -> None:
+        errors.append(error)
+        stop.set()
+
+    def feed() -> None:
+        try:
+            for item in items:
+                if not put(queues[0], item):
+                    return
+        except BaseException as e:
+            fail(e)
+            return
+        for _ in range(stages[0][1]):
+            put(queues[0], _DONE)
+
+    def work(stage_idx: int, remaining: List[int], lock: threading.Lock) -> None:
+        func, _ = stages[stage_idx]
+        in_q, out_q = queues[stage_idx], queues[stage_idx + 1]
+        try:
+            while (item := get(in_q)) is not _DONE:
+                result = func(item)
+                if result is not None and not put(out_q, result):
+                    return
+        except BaseException as e:
+            fail(e)
+            return
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            # The last worker of a stage to finish closes the next stage.
+            next_workers = stages[stage_idx + 1][1] if stage_idx + 1 < len(stages) else 1
+            for _ in range(next_workers):
+                put(out_q, _DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for stage_idx, (_, num_workers) in enumerate(stages):
+        remaining, lock = [num_workers], threading.Lock()
+        threads += [
+            threading.Thread(target=work, args=(stage_idx, remaining, lock), daemon=True)
+            for _ in range(num_workers)
+        ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while (result := get(queues[-1])) is not _DONE:
+            yield result
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,241 @@
+import os
+import json
+import mmap
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+import cv2
+import numpy as np
+
+# A packed dataset is a folder holding:
+#   shards/shard_00000.bin  encoded images stored back to back, each shard about `shard_size` bytes
+#   index.npy               one INDEX_DTYPE row per image: where its bytes and boxes are
+#   bboxes.npy              BOX_DTYPE table, one (image, class, x, y, w, h) row per box, grouped by image; np.load(mmap_mode="r")-able
+#   packed.json             format version, class names and image names; written last, so its presence marks a complete dataset
+# Version 1 stored bboxes.npy as a float32 (image_idx, class, x, y, w, h) table; it is still readable.
+PACKED_VERSION = 2
+PACKED_MANIFEST = "packed.json"
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+INDEX_DTYPE = np.dtype([
+    ("shard", "<i4"), ("offset", "<i8"), ("length", "<i8"),
+    ("box_start", "<i8"), ("box_count", "<i8"), ("labeled", "?"),
+])
+BOX_DTYPE = np.dtype([
+    ("image", "<i8"), ("class", "<i4"), ("x", "<f4"), ("y", "<f4"), ("w", "<f4"), ("h", "<f4"),
+])
+
+def is_packed_dataset(path: Path) -> bool:
+    return (Path(path) / PACKED_MANIFEST).is_file()
+
+def _replace_file(path: Path, write) -> None:
+    # Files in a packed dataset may be hard-linked into a staged copy, so they are replaced, never rewritten.
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _convert_v1_boxes(table: np.ndarray) -> np.ndarray:
+    boxes = np.zeros(len(table), dtype=BOX_DTYPE)
+    boxes["image"] = table[:, 0].astype(np.int64)
+    boxes["class"] = table[:, 1].astype(np.int32)
+    for i, column in enumerate("xywh", start=2):
+        boxes[column] = table[:, i]
+    return boxes
+
+class ShardWriter:
+    """
+    Writes images and their boxes into a packed dataset, one shard file at a time.
+    Adding an image under a name that was already added replaces the earlier entry (its bytes stay in
+    the shard but are no longer indexed), like overwriting a file in the folder layout.
+    With `append=True` an existing packed dataset is extended: existing shards are left untouched and
+    new images go to new shard files. Safe to call `add()` from several threads.
+    """
+    def __init__(self, path: Path, classes: Optional[List[str]] = None,
+                 shard_size: int = DEFAULT_SHARD_SIZE, append: bool = False):
+        self.path = Path(path)
+        self.shard_size = shard_size
+        self.classes = list(classes or [])
+        self.names: List[str] = []
+        self._lookup: Dict[str, int] = {}
+        self._alive = array('b')
+        self._shard, self._offset, self._length = array('i'), array('q'), array('q')
+        self._labeled = array('b')
+        # Box columns; the entry number stays an integer, so it is exact for any number of images.
+        self._box_entry, self._box_class, self._box_coords = array('q'), array('i'), array('f')
+        self._num_shards = 0
+        self._file = None
+        self._file_size = 0
+        self._lock = threading.Lock()
+        (self.path / "shards").mkdir(parents=True, exist_ok=True)
+        if append and is_packed_dataset(self.path):
+            self._load_existing()
+
+    def _load_existing(self) -> None:
+        with ShardReader(self.path) as reader:
+            self.classes = self.classes or reader.classes
+            self._num_shards = reader.num_shards
+            self.names = list(reader.names)
+            self._lookup = {name: i for i, name in enumerate(self.names)}
+            self._alive.extend([1] * len(reader))
+            self._shard.extend(reader.index["shard"].tolist())
+            self._offset.extend(reader.index["offset"].tolist())
+            self._length.extend(reader.index["length"].tolist())
+            self._labeled.extend(reader.index["labeled"].astype(np.int8).tolist())
+            table = reader.bbox_table
+            self._box_entry.extend(table["image"].tolist())
+            self._box_class.extend(table["class"].tolist())
+            self._box_coords.extend(np.stack([table[c] for c in "xywh"], axis=1).ravel().tolist())
+
+    def _shard_path(self, shard: int) -> Path:
+        return self.path / "shards" / f"shard_{shard:05d}.bin"
+
+    def add(self, name: str, data: bytes, bboxes: List[list], labeled: bool = True) -> int:
+        """Appends one encoded image and its `[class_id, x, y, w, h]` boxes. Returns its entry number."""
+        with self._lock:
+            if self._file is None or (self._file_size > 0 and self._file_size + len(data) > self.shard_size):
+                self._open_next_shard()
+            entry = len(self.names)
+            previous = self._lookup.get(name)
+            if previous is not None:
+                self._alive[previous] = 0
+            self._lookup[name] = entry
+            self.names.append(name)
+            self._alive.append(1)
+            self._shard.append(self._num_shards - 1)
+            self._offset.append(self._file_size)
+            self._length.append(len(data))
+            self._labeled.append(1 if labeled else 0)
+            for box in bboxes:
+                self._box_entry.append(entry)
+                self._box_class.append(int(box[0]))
+                self._box_coords.extend(float(v) for v in box[1:5])
+            self._file.write(data)
+            self._file_size += len(data)
+            return entry
+
+    def _open_next_shard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        shard_path = self._shard_path(self._num_shards)
+        shard_path.unlink(missing_ok=True)
+        self._file = open(shard_path, "wb")
+        self._file_size = 0
+        self._num_shards += 1
+
+    def close(self) -> None:
+        """Finishes the current shard and writes the index, the bbox table and the manifest."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            alive = np.frombuffer(self._alive, dtype=np.int8).astype(bool)
+            # Entries that were replaced are dropped and the survivors renumbered in order.
+            new_idx = np.cumsum(alive) - 1
+            entries = np.frombuffer(self._box_entry, dtype=np.int64)
+            keep = alive[entries]
+            coords = np.frombuffer(self._box_coords, dtype=np.float32).reshape(-1, 4)[keep]
+            boxes = np.zeros(int(keep.sum()), dtype=BOX_DTYPE)
+            boxes["image"] = new_idx[entries[keep]]
+            boxes["class"] = np.frombuffer(self._box_class, dtype=np.int32)[keep]
+            for i, column in enumerate("xywh"):
+                boxes[column] = coords[:, i]
+
+            index = np.zeros(int(alive.sum()), dtype=INDEX_DTYPE)
+            index["shard"] = np.frombuffer(self._shard, dtype=np.int32)[alive]
+            index["offset"] = np.frombuffer(self._offset, dtype=np.int64)[alive]
+            index["length"] = np.frombuffer(self._length, dtype=np.int64)[alive]
+            index["labeled"] = np.frombuffer(self._labeled, dtype=np.int8)[alive].astype(bool)
+            # Box rows are grouped by image, in image order, so each image owns one contiguous slice.
+            boxes = boxes[np.argsort(boxes["image"], kind="stable")]
+            counts = np.bincount(boxes["image"], minlength=len(index))
+            index["box_count"] = counts
+            index["box_start"] = np.concatenate([[0], np.cumsum(counts)[:-1]]) if len(index) else []
+
+            names = [name for name, keep in zip(self.names, alive) if keep]
+            _replace_file(self.path / "index.npy", lambda f: np.save(f, index))
+            _replace_file(self.path / "bboxes.npy", lambda f: np.save(f, boxes))
+            manifest = {"version": PACKED_VERSION, "classes": self.classes, "num_shards": self._num_shards,
+                        "shard_size": self.shard_size, "names": names}
+            _replace_file(self.path / PACKED_MANIFEST, lambda f: f.write(json.dumps(manifest).encode()))
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+
+class ShardReader:
+    """
+    Random access to a packed dataset without extracting it. Shards are memory-mapped on first use
+    and the bbox table is memory-mapped as a whole; reads are safe from several threads.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / PACKED_MANIFEST, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") not in (1, PACKED_VERSION):
+            raise ValueError(f"Unsupported packed dataset version: {manifest.get('version')}")
+        self.classes: List[str] = manifest["classes"]
+        self.names: List[str] = manifest["names"]
+        self.num_shards: int = manifest["num_shards"]
+        self.index = np.load(self.path / "index.npy")
+        self.bbox_table = np.load(self.path / "bboxes.npy", mmap_mode="r")
+        if manifest["version"] == 1:
+            self.bbox_table = _convert_v1_boxes(self.bbox_table)
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _shard_map(self, shard: int) -> mmap.mmap:
+        with self._lock:
+            shard_map = self._maps.get(shard)
+            if shard_map is None:
+                with open(self.path / "shards" / f"shard_{shard:05d}.bin", "rb") as f:
+                    shard_map = self._maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return shard_map
+
+    def read_bytes(self, i: int) -> bytes:
+        row = self.index[i]
+        if row["length"] == 0:
+            return b""
+        offset = int(row["offset"])
+        return self._shard_map(int(row["shard"]))[offset:offset + int(row["length"])]
+
+    def decode(self, i: int, flags: int = cv2.IMREAD_COLOR) -> Optional[np.ndarray]:
+        data = self.read_bytes(i)
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags) if data else None
+
+    def is_labeled(self, i: int) -> bool:
+        return bool(self.index[i]["labeled"])
+
+    def boxes(self, i: int) -> np.ndarray:
+        """The BOX_DTYPE rows of image `i` as a read-only view into the bbox table."""
+        start = int(self.index[i]["box_start"])
+        return self.bbox_table[start:start + int(self.index[i]["box_count"])]
+
+    def bboxes(self, i: int) -> List[list]:
+        """Boxes of image `i` in the `[class_id, x, y, w, h]` list format, with the class id as a string."""
+        return [[str(int(row["class"]))] + [float(row[c]) for c in "xywh"] for row in self.boxes(i)]
+
+    def label_text(self, i: int) -> str:
+        """Boxes of image `i` as YOLO label text."""
+        return "".join(f"{int(row['class'])} {row['x']:.6f} {row['y']:.6f} {row['w']:.6f} {row['h']:.6f}\n"
+                       for row in self.boxes(i))
+
+    def close(self) -> None:
+        with self._lock:
+            for shard_map in self._maps.values():
+                shard_map.close()
+            self._maps.clear()
+
+    def __enter__(self) -> "ShardReader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
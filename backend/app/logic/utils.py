@@ -1,11 +1,100 @@
+import os
 import shutil
-from pathlib import Path
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Iterator, Optional
 
-def create_zip_from_directory(dir_path: Path, zip_path: Path):
+from .metrics import StageMetrics
+
+# Already-compressed media gains nothing from deflate, so it is stored as-is.
+# `.bin` files are packed-dataset shards, which hold encoded images.
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".zip", ".gz", ".mp4", ".bin"}
+
+class _ZipStreamSink:
+    """
+    Write-only file object that collects what ZipFile writes so it can be yielded in chunks.
+    It has no tell()/seek(), so ZipFile writes data descriptors instead of seeking back into headers.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        if chunks:
+            yield b"".join(chunks)
+
+def iter_zip_stream(dir_path: Path, chunk_size: int = 1024 * 1024, metrics: Optional[StageMetrics] = None) -> Iterator[bytes]:
+    """
+    Generates a ZIP archive of a directory on the fly, without writing a temporary archive.
+    Media files are stored uncompressed and everything else (labels, reports) is deflated.
+    Members are laid out like `shutil.make_archive` would, with paths relative to `dir_path`.
+    With `metrics`, files archived, bytes read/written and the time spent reading and compressing
+    (excluding time the consumer holds the generator) are recorded.
+    """
+    metrics = metrics or StageMetrics("export")
+    sink = _ZipStreamSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for root, dirnames, filenames in os.walk(dir_path):
+            dirnames.sort()
+            root_path = Path(root)
+            for name in dirnames:
+                archive.write(root_path / name, (root_path / name).relative_to(dir_path).as_posix())
+            for name in sorted(filenames):
+                path = root_path / name
+                info = zipfile.ZipInfo.from_file(path, path.relative_to(dir_path).as_posix())
+                info.compress_type = zipfile.ZIP_STORED if path.suffix.lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                with open(path, "rb") as src, archive.open(info, "w") as dst:
+                    while True:
+                        with metrics.phase("compress", per_thread=True):
+                            chunk = src.read(chunk_size)
+                            dst.write(chunk)
+                        if not chunk:
+                            break
+                        metrics.add("bytes_read", len(chunk))
+                        yield from _drain_counted(sink, metrics)
+                yield from _drain_counted(sink, metrics)
+                metrics.add("files_archived")
+    yield from _drain_counted(sink, metrics)
+
+def _drain_counted(sink: _ZipStreamSink, metrics: StageMetrics) -> Iterator[bytes]:
+    for data in sink.drain():
+        metrics.add("bytes_written", len(data))
+        yield data
+
+def create_zip_from_directory(dir_path: Path, zip_path: Path, metrics: Optional[StageMetrics] = None):
     """
     Creates a zip archive from a directory.
+    Like `shutil.make_archive`, ".zip" is appended to `zip_path`.
+    """
+    with open(f"{zip_path}.zip", "wb") as f:
+        for chunk in iter_zip_stream(dir_path, metrics=metrics):
+            f.write(chunk)
+
+def stage_directory(src_dir: Path, dst_dir: Path) -> dict:
     """
-    shutil.make_archive(str(zip_path), 'zip', str(dir_path))
+    Recreates `src_dir` at `dst_dir` using hard links instead of copies, so both trees share the same
+    file data on disk. Falls back to a regular copy for files that cannot be linked (e.g. another filesystem).
+    New files written into `dst_dir` do not affect `src_dir`; existing files must be replaced, not edited in place.
+    """
+    counts = {"linked": 0, "copied": 0}
+    for root, _, files in os.walk(src_dir):
+        target_root = dst_dir / Path(root).relative_to(src_dir)
+        target_root.mkdir(parents=True, exist_ok=True)
+        for name in files:
+            try:
+                os.link(Path(root) / name, target_root / name)
+                counts["linked"] += 1
+            except OSError:
+                shutil.copy2(Path(root) / name, target_root / name)
+                counts["copied"] += 1
+    return counts
 
 def validate_dataset_structure(filenames: list[str]) -> tuple[bool, str]:
     """
@@ -19,4 +108,39 @@ def validate_dataset_structure(filenames: list[str]) -> tuple[bool, str]:
     if not has_images:
         return False, "Error: The 'images' folder is missing or is empty."
 
-    return True, "Validation successful."
\ No newline at end of file
+    return True, "Validation successful."
+
+def dataset_members_in_zip(archive: zipfile.ZipFile) -> dict[str, zipfile.ZipInfo]:
+    """
+    Maps dataset-relative paths to the file members of a ZIP archive.
+    A single folder wrapping the whole dataset (e.g. `my_dataset/classes.txt`) is stripped,
+    and unsafe paths and macOS metadata entries are skipped.
+    """
+    members = {}
+    for info in archive.infolist():
+        path = PurePosixPath(info.filename)
+        if info.is_dir() or path.is_absolute() or ".." in path.parts:
+            continue
+        if path.parts[0] == "__MACOSX" or path.name == ".DS_Store":
+            continue
+        members[path.as_posix()] = info
+
+    top_levels = {PurePosixPath(name).parts[0] for name in members}
+    if "classes.txt" not in members and len(top_levels) == 1 and all("/" in name for name in members):
+        prefix = top_levels.pop() + "/"
+        members = {name[len(prefix):]: info for name, info in members.items()}
+    return members
+
+def extract_zip_streaming(zip_path: Path, dest_dir: Path, chunk_size: int = 1024 * 1024) -> list[str]:
+    """
+    Extracts a dataset ZIP member by member, copying each one in fixed-size chunks so the
+    archive is never held in memory. Returns the dataset-relative names of the extracted files.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        members = dataset_members_in_zip(archive)
+        for name, info in members.items():
+            target = dest_dir / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with archive.open(info) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, chunk_size)
+    return list(members)
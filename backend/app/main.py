@@ -1,10 +1,32 @@
+import sys
+import time
+
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .api import router
+from fastapi.responses import PlainTextResponse
+from .api import router, JOBS
+from .logic.metrics import render_prometheus
+
+# Only job worker processes should load these; seeing one in the API process is a cold-start regression.
+HEAVY_MODULES = ("cv2", "numpy")
+STARTUP = {"import_seconds": round(time.perf_counter() - _import_started, 4), "startup_seconds": None}
+
+def startup_info() -> dict:
+    return {**STARTUP, "heavy_modules": {name: name in sys.modules for name in HEAVY_MODULES}}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Time from the start of this module's imports until the app is ready to serve.
+    STARTUP["startup_seconds"] = round(time.perf_counter() - _import_started, 4)
+    yield
 
 app = FastAPI(
     title="Dataset Cleaner & Augmentor API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 origins = [
@@ -24,4 +46,10 @@ app.include_router(router, prefix="/api")
 
 @app.get("/", tags=["Root"])
 async def read_root():
-    return {"message": "API is running. Visit /docs for documentation."}
\ No newline at end of file
+    return {"message": "API is running. Visit /docs for documentation.", "startup": startup_info()}
+
+@app.get("/metrics", tags=["Root"], response_class=PlainTextResponse)
+def read_metrics():
+    """Prometheus text-format job, phase timing, throughput and latency metrics, aggregated over all jobs."""
+    text = render_prometheus(JOBS.records(), JOBS.queue_info(), startup_info())
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
@@ -3,6 +3,27 @@ from typing import List, Optional, Dict
 
 class CleaningParams(BaseModel): # <-- ADD THIS NEW CLASS
     remove_unlabeled_images: bool = Field(default=False, description="If true, permanently deletes images that have no valid labels after cleaning.")
+    num_workers: int = Field(default=1, ge=0, description="Number of worker processes used to clean images in parallel. 0 uses all available CPU cores.")
+    incremental: bool = Field(default=True, description="If true, re-cleaning a job only reprocesses images or labels that changed since the last run.")
+    jpeg_passthrough: bool = Field(default=False, description="If true, images that are already valid JPEGs are saved byte-for-byte instead of being re-encoded.")
+    output_format: str = Field(
+        default="files", pattern="^(files|shards)$",
+        description="'files' writes images/ and labels/ folders. 'shards' writes a packed dataset: large shard files of encoded images, an offset index and one bbox table. Augmentation keeps the format of the cleaned dataset."
+    )
+    shard_size_mb: int = Field(default=256, ge=1, description="Approximate size in MB of each shard file when output_format is 'shards'.")
+    duplicate_handling: str = Field(
+        default="off", pattern="^(off|report|drop|quarantine)$",
+        description="What to do with exact and near-duplicate images: 'off' skips detection, 'report' only counts them, 'drop' leaves them out and 'quarantine' moves them to a duplicates/ folder."
+    )
+    near_duplicate_threshold: int = Field(
+        default=4, ge=0, le=10,
+        description="Maximum number of differing perceptual-hash bits (out of 64) for two images to count as near duplicates. 0 only catches visually identical images."
+    )
+    max_side: Optional[int] = Field(
+        default=None, ge=1,
+        description="If set, images are shrunk so their longest side is at most this many pixels (e.g. 640). Smaller images are kept as they are."
+    )
+    letterbox: bool = Field(default=False, description="With max_side, also pads every image to a max_side x max_side square and adjusts the labels to match.")
 
 class AugmentationParams(BaseModel):
     random_seed: int = Field(default=42, description="Seed for reproducibility.")
@@ -14,6 +35,30 @@ class AugmentationParams(BaseModel):
         default=None,
         description="Optional maximum number of images per class. If null, balances to the majority class."
     )
+    cache_size_mb: int = Field(
+        default=256, ge=0,
+        description="Memory budget in MB for caching decoded source images between augmentation draws. 0 disables the cache."
+    )
+    reader_workers: int = Field(default=2, ge=1, description="Threads decoding source images in the augmentation pipeline.")
+    transform_workers: int = Field(default=2, ge=1, description="Threads applying augmentations in the augmentation pipeline.")
+    writer_workers: int = Field(default=2, ge=1, description="Threads encoding and writing augmented images and labels.")
+    pipeline_queue_size: int = Field(default=32, ge=1, description="Maximum number of samples waiting between two pipeline stages.")
+    pipeline_batch_size: int = Field(
+        default=1, ge=1,
+        description="Samples moved through the pipeline together. With compose_augmentations, same-size images in a batch share one warp call."
+    )
+    compose_augmentations: bool = Field(
+        default=False,
+        description="If true, each generated image combines several enabled augmentations, with all geometric ones applied as a single warp."
+    )
+    compose_probability: float = Field(
+        default=0.5, ge=0, le=1,
+        description="With compose_augmentations, the chance that each enabled augmentation is included in a sample (at least one always is)."
+    )
+    balancing_strategy: str = Field(
+        default="co_occurrence", pattern="^(per_class|co_occurrence)$",
+        description="'co_occurrence' plans all samples together, so an image with several minority classes counts towards each of them. 'per_class' balances each class on its own, which overshoots classes that often appear together."
+    )
 
 class JobStatusResponse(BaseModel):
     job_id: str
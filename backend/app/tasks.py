@@ -0,0 +1,89 @@
+import json
+import shutil
+
+# Cleaning and augmentation tasks. JobRunner imports this module by name inside its worker processes
+# (see `_execute_job`), so OpenCV and NumPy are only ever loaded there, never in the API process.
+from app.config import BASE_DIR, JOBS_DB, PROGRESS_INTERVAL
+from app.logic.clean_dataset import clean_dataset
+from app.logic.augment_dataset import main as augment_dataset_main
+from app.logic.metrics import StageMetrics
+from app.logic.utils import stage_directory
+from app.jobs import JobStore
+from app.schemas import AugmentationParams, CleaningParams
+
+# A separate handle on the same SQLite file the API uses.
+JOBS = JobStore(JOBS_DB)
+
+def _job_metrics(job_id: str, stage: str, key: str) -> StageMetrics:
+    # Each snapshot is stored as `<key>_metrics`, with a short summary under `progress` for polling clients.
+    def publish(snapshot: dict) -> None:
+        progress = {k: snapshot[k] for k in ("stage", "phase", "done", "total", "percent", "elapsed_seconds")}
+        JOBS.update(job_id, {"progress": progress, f"{key}_metrics": snapshot})
+    return StageMetrics(stage, on_progress=publish, interval=PROGRESS_INTERVAL)
+
+def run_cleaning_task(job_id: str, params: CleaningParams):
+    job_dir = BASE_DIR / job_id
+    metrics = _job_metrics(job_id, "cleaning", "clean")
+    try:
+        with open(job_dir / "raw" / "classes.txt", "r") as f:
+            classes = [line.strip() for line in f if line.strip()]
+        stats = clean_dataset(
+            base_path=job_dir / "raw", output_path=job_dir / "cleaned",
+            classes=classes, remove_unlabeled_images=params.remove_unlabeled_images,
+            num_workers=params.num_workers, incremental=params.incremental,
+            jpeg_passthrough=params.jpeg_passthrough, metrics=metrics,
+            output_format=params.output_format, shard_size=params.shard_size_mb * 1024 * 1024,
+            duplicate_handling=params.duplicate_handling, near_duplicate_threshold=params.near_duplicate_threshold,
+            max_side=params.max_side, letterbox=params.letterbox
+        )
+        metrics.finish()
+        JOBS.update(job_id, {"status": "cleaned", "clean_stats": stats})
+    except Exception as e:
+        metrics.finish()
+        JOBS.update(job_id, {"status": "error", "details": {"error": f"Cleaning failed: {str(e)}", "stage": "cleaning"}})
+
+# --- THIS IS THE NEW, MORE ROBUST AUGMENTATION TASK ---
+def run_augmentation_task(job_id: str, params: AugmentationParams):
+    job_dir = BASE_DIR / job_id
+    cleaned_dir = job_dir / "cleaned"
+    augmented_dir = job_dir / "augmented"
+    metrics = _job_metrics(job_id, "augmentation", "augment")
+
+    try:
+        # Step 1: Stage the cleaned dataset in the augmented directory with hard links.
+        # All original files (images, labels, no_label) are present without copying their data,
+        # and only the new augmented files take up extra disk space.
+        with metrics.phase("staging"):
+            if augmented_dir.exists():
+                shutil.rmtree(augmented_dir)
+            staging = stage_directory(cleaned_dir, augmented_dir)
+
+        # Step 2: Call the simplified augmentation script to work IN-PLACE.
+        # It will now add its new files to the already-copied dataset.
+        report = augment_dataset_main(
+            data_dir=augmented_dir, # Only one directory parameter now
+            seed=params.random_seed, 
+            enabled_augmentations=params.enabled_augmentations,
+            augmentation_cap=params.augmentation_cap,
+            cache_max_bytes=params.cache_size_mb * 1024 * 1024,
+            reader_workers=params.reader_workers,
+            transform_workers=params.transform_workers,
+            writer_workers=params.writer_workers,
+            queue_size=params.pipeline_queue_size,
+            batch_size=params.pipeline_batch_size,
+            compose_augmentations=params.compose_augmentations,
+            compose_probability=params.compose_probability,
+            balancing_strategy=params.balancing_strategy,
+            metrics=metrics
+        )
+        
+        # Step 3: Save the report. The ZIP is streamed from the directory on download.
+        with open(augmented_dir / "report.json", 'w') as f:
+            json.dump(report, f, indent=4)
+        
+        metrics.finish()
+        JOBS.update(job_id, {"status": "augmented", "augment_report": report, "staging": staging})
+
+    except Exception as e:
+        metrics.finish()
+        JOBS.update(job_id, {"status": "error", "details": {"error": f"Augmentation failed: {str(e)}", "stage": "augmentation"}})
@@ -0,0 +1,272 @@
+"""
+Throughput benchmarks for the cleaning, augmentation and export stages, and the API's cold import time.
+
+Run from the `backend/` directory:
+
+    python -m benchmarks.run_benchmarks --images 500 --output bench.json
+    python -m benchmarks.run_benchmarks --images 500 --baseline bench.json
+
+Each stage runs in a fresh process so its peak RSS is measured on its own.
+With --baseline, the run is compared against a previous results file and the
+command exits with status 1 if any metric regressed by more than --tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import cv2
+import numpy as np
+
+from app.logic.augment_dataset import AUGMENTATION_MAP, COMPOSE_ORDER, compose, compose_batch, stack_bboxes, main as augment_dataset_main
+from app.logic.clean_dataset import clean_dataset
+from app.logic.utils import create_zip_from_directory
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Metrics where a larger value is better; every other "seconds"-style metric is lower-is-better.
+HIGHER_IS_BETTER = {"images_per_sec", "samples_per_sec", "mb_per_sec", "calls_per_sec"}
+# Counts that must never grow, whatever the tolerance.
+MUST_NOT_INCREASE = {"heavy_modules_loaded"}
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+def synthesize_dataset(
+    root: Path, num_images: int, width: int, height: int, num_classes: int,
+    imbalance: float, seed: int = 0
+) -> Path:
+    """
+    Writes a raw YOLO dataset (`images/`, `labels/`, `classes.txt`) under `root`.
+    Class k is picked with probability proportional to imbalance ** -k, so the majority class
+    is about `imbalance` times more frequent than the next one. Images have 1-4 boxes each.
+    """
+    rng = np.random.default_rng(seed)
+    (root / "images").mkdir(parents=True, exist_ok=True)
+    (root / "labels").mkdir(parents=True, exist_ok=True)
+    with open(root / "classes.txt", "w") as f:
+        f.writelines(f"class{k}\n" for k in range(num_classes))
+
+    weights = np.array([imbalance ** -k for k in range(num_classes)])
+    weights /= weights.sum()
+    # A smooth gradient plus noise compresses like a photo rather than like pure noise.
+    base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None].repeat(height, 0).repeat(3, 2)
+    for i in range(num_images):
+        noise = rng.normal(0, 25, (height, width, 3)).astype(np.float32)
+        img = np.clip(base + noise + rng.integers(-60, 60), 0, 255).astype(np.uint8)
+        cv2.imwrite(str(root / "images" / f"img_{i:07d}.jpg"), img)
+        lines = []
+        for _ in range(rng.integers(1, 5)):
+            class_id = rng.choice(num_classes, p=weights)
+            w, h = rng.uniform(0.05, 0.4, 2)
+            x, y = rng.uniform(w / 2, 1 - w / 2), rng.uniform(h / 2, 1 - h / 2)
+            lines.append(f"{class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n")
+        with open(root / "labels" / f"img_{i:07d}.txt", "w") as f:
+            f.writelines(lines)
+    return root
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+def bench_clean(workdir: str, num_workers: int, max_side: Optional[int] = None) -> Dict:
+    workdir = Path(workdir)
+    classes = [line.strip() for line in open(workdir / "raw" / "classes.txt") if line.strip()]
+    # Resized output goes to its own folder so the later stages still see the full-resolution clean.
+    output = workdir / ("cleaned" if max_side is None else "cleaned_resized")
+    started = time.perf_counter()
+    stats = clean_dataset(workdir / "raw", output, classes, num_workers=num_workers, max_side=max_side)
+    seconds = time.perf_counter() - started
+    return {
+        "seconds": round(seconds, 4),
+        "images_per_sec": round(stats["images_processed"] / seconds, 2),
+        "output_mb": round(_dir_size(output) / (1024 * 1024), 2),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+def bench_augmentation_functions(width: int, height: int, calls: int) -> Dict:
+    rng = random.Random(0)
+    img = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    bboxes = [["0", 0.5, 0.5, 0.2, 0.2], ["1", 0.3, 0.6, 0.1, 0.3]]
+    # "compose" applies every augmentation to one sample with a single warp, for comparison with chaining them.
+    funcs = {**AUGMENTATION_MAP, "compose": lambda img, bboxes, rng: compose(img, bboxes, COMPOSE_ORDER, rng)}
+    results = {}
+    for name, func in funcs.items():
+        latencies = []
+        for _ in range(calls):
+            started = time.perf_counter()
+            func(img.copy(), bboxes, rng)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        results[name] = {
+            "mean_ms": round(statistics.mean(latencies) * 1000, 4),
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 4),
+            "calls_per_sec": round(len(latencies) / sum(latencies), 2),
+        }
+    # "compose_batch" runs the same composition on 16 images per call; latencies are per image.
+    stack = np.repeat(img[None], 16, axis=0)
+    box_array, image_idx = stack_bboxes([bboxes] * len(stack))
+    latencies = []
+    for _ in range(max(1, calls // len(stack))):
+        started = time.perf_counter()
+        compose_batch(stack, box_array, image_idx, [COMPOSE_ORDER] * len(stack), [rng] * len(stack))
+        latencies.append((time.perf_counter() - started) / len(stack))
+    latencies.sort()
+    results["compose_batch"] = {
+        "mean_ms": round(statistics.mean(latencies) * 1000, 4),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 4),
+        "calls_per_sec": round(len(latencies) / sum(latencies), 2),
+    }
+    return results
+
+def bench_augment(workdir: str, seed: int, workers: int) -> Dict:
+    workdir = Path(workdir)
+    data_dir = workdir / "augmented"
+    if data_dir.exists():
+        shutil.rmtree(data_dir)
+    shutil.copytree(workdir / "cleaned", data_dir)
+    started = time.perf_counter()
+    report = augment_dataset_main(
+        data_dir, seed, list(AUGMENTATION_MAP), None,
+        reader_workers=workers, transform_workers=workers, writer_workers=workers
+    )
+    seconds = time.perf_counter() - started
+    samples = report.get("total_augmentations_applied", 0)
+    return {
+        "seconds": round(seconds, 4),
+        "samples": samples,
+        "samples_per_sec": round(samples / seconds, 2) if seconds > 0 else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+def bench_zip(workdir: str) -> Dict:
+    workdir = Path(workdir)
+    source = workdir / "augmented"
+    started = time.perf_counter()
+    create_zip_from_directory(source, workdir / "export")
+    seconds = time.perf_counter() - started
+    size_mb = _dir_size(source) / (1024 * 1024)
+    return {
+        "seconds": round(seconds, 4),
+        "mb_per_sec": round(size_mb / seconds, 2),
+        "archive_mb": round((workdir / "export.zip").stat().st_size / (1024 * 1024), 2),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+def bench_api_import(runs: int = 3) -> Dict:
+    """Imports `app.main` in fresh interpreters, as a new API worker does, and keeps the fastest run."""
+    code = ("import json, sys, time; started = time.perf_counter(); import app.main; "
+            "print(json.dumps([time.perf_counter() - started, app.main.startup_info()]))")
+    timings = []
+    with tempfile.TemporaryDirectory(prefix="dataset-bench-api-") as cwd:  # app.main creates data/ in the cwd
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", code], cwd=cwd, env={**os.environ, "PYTHONPATH": str(BACKEND_DIR)},
+                                 check=True, capture_output=True, text=True).stdout
+            timings.append(json.loads(out.splitlines()[-1]))
+    seconds, info = min(timings, key=lambda t: t[0])
+    return {
+        "import_seconds": round(seconds, 4),
+        "heavy_modules_loaded": sum(info["heavy_modules"].values()),
+    }
+
+def _isolated(func: Callable, *args) -> Dict:
+    # A fresh process per stage keeps peak RSS and warm caches from leaking between measurements.
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(func, *args).result()
+
+def run(args: argparse.Namespace) -> Dict:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="dataset-bench-") as tmp:
+        started = time.perf_counter()
+        synthesize_dataset(Path(tmp) / "raw", args.images, args.width, args.height, args.classes, args.imbalance)
+        print(f"synthesized {args.images} images in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        results["clean"] = _isolated(bench_clean, tmp, 1)
+        if args.workers > 1:
+            results[f"clean_parallel_{args.workers}"] = _isolated(bench_clean, tmp, args.workers)
+        if args.max_side:
+            results[f"clean_max_side_{args.max_side}"] = _isolated(bench_clean, tmp, 1, args.max_side)
+        for name, metrics in _isolated(bench_augmentation_functions, args.width, args.height, args.calls).items():
+            results[f"augmentation.{name}"] = metrics
+        results["augment_dataset"] = _isolated(bench_augment, tmp, args.seed, args.workers)
+        results["zip_export"] = _isolated(bench_zip, tmp)
+    results["api_import"] = bench_api_import()
+
+    return {
+        "meta": {
+            "images": args.images, "width": args.width, "height": args.height, "classes": args.classes,
+            "imbalance": args.imbalance, "workers": args.workers, "seed": args.seed,
+            "python": platform.python_version(), "opencv": cv2.__version__, "numpy": np.__version__,
+            "machine": platform.machine(), "cpu_count": multiprocessing.cpu_count(),
+        },
+        "results": results,
+    }
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> list:
+    """Returns a description of every metric that is worse than the baseline by more than `tolerance`."""
+    regressions = []
+    for bench, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            base = baseline.get("results", {}).get(bench, {}).get(metric)
+            if metric in MUST_NOT_INCREASE and isinstance(base, int) and value > base:
+                regressions.append(f"{bench}.{metric}: {base} -> {value}")
+                continue
+            if not isinstance(value, (int, float)) or not isinstance(base, (int, float)) or base <= 0:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                change = (base - value) / base
+            elif metric.endswith(("seconds", "_ms", "_mb")):
+                change = (value - base) / base
+            else:
+                continue
+            if change > tolerance:
+                regressions.append(f"{bench}.{metric}: {base} -> {value} ({change:+.0%} worse)")
+    return regressions
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200, help="Number of synthetic images.")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--classes", type=int, default=4)
+    parser.add_argument("--max-side", type=int, help="Also time cleaning with images resized to this longest side.")
+    parser.add_argument("--imbalance", type=float, default=3.0, help="Frequency ratio between consecutive classes.")
+    parser.add_argument("--workers", type=int, default=4, help="Workers for the parallel cleaning and augmentation runs.")
+    parser.add_argument("--calls", type=int, default=50, help="Calls per augmentation function.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, help="Write the results JSON here (default: stdout).")
+    parser.add_argument("--baseline", type=Path, help="Results JSON from a previous run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before failing.")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    current = run(args)
+    text = json.dumps(current, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        regressions = compare(current, json.loads(args.baseline.read_text()), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
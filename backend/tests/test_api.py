@@ -0,0 +1,109 @@
+import io
+import sys
+import zipfile
+from pathlib import Path
+import pytest
+from fastapi.testclient import TestClient
+from backend.app.jobs import JobStore
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    # The API imports its modules as `app.*`, and app.config creates data/ in the working directory on import.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(BACKEND_DIR))
+    from app import api
+    api.JOB_RUNNER.shutdown()  # no jobs run in these tests; stops its heartbeat thread
+    monkeypatch.setattr(api, "BASE_DIR", tmp_path / "jobs")
+    monkeypatch.setattr(api, "JOBS", JobStore(tmp_path / "jobs.db"))
+    return api
+
+@pytest.fixture
+def client(api):
+    from app.main import app
+    with TestClient(app) as client:
+        yield client
+
+def _zip_bytes(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+def test_upload_streams_files_in_chunks(api, client, monkeypatch):
+    monkeypatch.setattr(api, "UPLOAD_CHUNK_SIZE", 1000)
+    image = bytes(range(256)) * 20
+    files = [("files", ("classes.txt", b"cat\n")), ("files", ("images/a.jpg", image)),
+             ("files", ("labels/a.txt", b"0 0.5 0.5 0.1 0.1\n"))]
+
+    response = client.post("/api/upload", files=files)
+
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+    raw = api.BASE_DIR / job_id / "raw"
+    assert (raw / "images/a.jpg").read_bytes() == image
+    ingest = api.JOBS.get(job_id)["ingest"]
+    assert ingest["source"] == "files" and ingest["bytes"] == len(image) + 4 + 18
+    assert 0 < ingest["peak_buffer_bytes"] <= 1000 * api.UPLOAD_CONCURRENCY
+    assert ingest["peak_rss_bytes"] > 0
+
+def test_upload_zip_with_wrapper_folder(api, client):
+    archive = _zip_bytes({"ds/classes.txt": "cat\n", "ds/images/a.jpg": b"img", "__MACOSX/ds/._a.jpg": "x"})
+
+    response = client.post("/api/upload", files=[("files", ("dataset.zip", archive))])
+
+    assert response.status_code == 200
+    job_dir = api.BASE_DIR / response.json()["job_id"]
+    assert sorted(p.relative_to(job_dir).as_posix() for p in job_dir.rglob("*") if p.is_file()) == [
+        "raw/classes.txt", "raw/images/a.jpg"]
+
+def test_failed_zip_extraction_leaves_nothing_behind(api, client):
+    archive = bytearray(_zip_bytes({"classes.txt": "cat\n", "images/a.jpg": b"original image bytes"}))
+    # Damage the stored member data; the central directory still lists it, so only extraction fails.
+    start = archive.index(b"original image bytes")
+    archive[start:start + 8] = b"tampered"
+
+    response = client.post("/api/upload", files=[("files", ("dataset.zip", bytes(archive)))])
+
+    assert response.status_code == 400
+    assert "corrupted" in response.json()["detail"]
+    assert not api.BASE_DIR.exists() or not any(api.BASE_DIR.iterdir())
+
+@pytest.mark.parametrize("job, cleaned, augmented", [
+    ({"status": "cleaning"}, 404, 404),
+    ({"status": "cleaned"}, 200, 404),
+    ({"status": "augmenting"}, 200, 404),
+    ({"status": "augmented"}, 200, 200),
+    ({"status": "error", "details": {"stage": "cleaning"}}, 404, 404),
+    ({"status": "error", "details": {"stage": "augmentation"}}, 200, 404),
+])
+def test_download_only_serves_complete_results(api, client, job, cleaned, augmented):
+    for result_type in ("cleaned", "augmented"):
+        (api.BASE_DIR / "job" / result_type / "images").mkdir(parents=True)
+        (api.BASE_DIR / "job" / result_type / "images/a.jpg").write_bytes(result_type.encode() * 1000)
+    api.JOBS.create("job", job)
+
+    for result_type, expected in (("cleaned", cleaned), ("augmented", augmented)):
+        response = client.get(f"/api/download/job/{result_type}")
+        assert response.status_code == expected
+        if expected == 200:
+            archive = zipfile.ZipFile(io.BytesIO(response.content))
+            assert archive.testzip() is None
+            assert archive.read("images/a.jpg") == result_type.encode() * 1000
+            assert api.JOBS.get("job")[f"{result_type}_export"]["completed"]
+
+def test_cleaned_result_stays_downloadable_after_an_orphaned_augmentation(api, client):
+    (api.BASE_DIR / "job" / "cleaned").mkdir(parents=True)
+    (api.BASE_DIR / "job" / "cleaned" / "classes.txt").write_text("cat\n")
+    old = JobStore(api.JOBS.db_path, instance_id="old")
+    old.create("job", {"status": "cleaned"})
+    assert old.enqueue("job", {"status": "augmenting"}, limit=1, stage="augmentation")
+
+    api.JOBS.fail_orphaned_jobs(stale_after=0)
+
+    assert api.JOBS.get("job")["status"] == "error"
+    response = client.get("/api/download/job/cleaned")
+    assert response.status_code == 200
+    assert zipfile.ZipFile(io.BytesIO(response.content)).read("classes.txt") == b"cat\n"
@@ -1,6 +1,7 @@
 import pytest
 import numpy as np
-from backend.app.logic.augment_dataset import flip
+import random
+from backend.app.logic.augment_dataset import flip, translate, DecodedImageCache
 
 def test_flip_augmentation():
     # Mock image (not actually used in bbox calculation, but good practice)
@@ -18,4 +19,224 @@ def test_flip_augmentation():
     assert pytest.approx(flipped_box[1]) == 0.8 # x_center
     assert flipped_box[2] == 0.3 # y_center should not change
     assert flipped_box[3] == 0.1 # width should not change
-    assert flipped_box[4] == 0.15 # height should not change
\ No newline at end of file
+    assert flipped_box[4] == 0.15 # height should not change
+
+def test_decoded_image_cache_evicts_least_recently_used_by_size():
+    img = np.zeros((10, 10, 3), dtype=np.uint8)  # 300 bytes
+    cache = DecodedImageCache(max_bytes=700)
+    cache.put("a", img, [])
+    cache.put("b", img.copy(), [])
+    assert cache.get("a") is not None  # "b" is now the least recently used entry
+    cache.put("c", img.copy(), [])
+
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 600
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_label_index_counts_and_sampling(tmp_path):
+    from backend.app.logic.label_index import LabelIndex
+    (tmp_path / "a.txt").write_text("0 0.5 0.5 0.2 0.2\n0 0.1 0.1 0.1 0.1\n1 0.3 0.3 0.1 0.1\n")
+    (tmp_path / "b.txt").write_text("1 0.4 0.4 0.2 0.2\n")
+    (tmp_path / "c.txt").write_text("\n")
+
+    index = LabelIndex.build(tmp_path)
+    assert index.stems == ["a", "b", "c"]
+    assert index.num_boxes == 4
+    assert index.image_counts_per_class() == {"0": 1, "1": 2}
+    assert index.files_for_class("1").tolist() == [0, 1]
+    assert index.bboxes(1) == [["1", pytest.approx(0.4), pytest.approx(0.4), pytest.approx(0.2), pytest.approx(0.2)]]
+
+    index.add("b_aug", [["0", 0.5, 0.5, 0.3, 0.3]])
+    assert index.image_counts_per_class() == {"0": 2, "1": 2}
+    assert index.files_for_class("0").tolist() == [0, 3]
+
+
+def _make_augmentation_dataset(root):
+    import cv2
+    (root / "images").mkdir(parents=True)
+    (root / "labels").mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(6):
+        cv2.imwrite(str(root / f"images/img{i}.jpg"), rng.integers(0, 255, (48, 64, 3), dtype=np.uint8))
+        class_id = 1 if i == 0 else 0
+        (root / f"labels/img{i}.txt").write_text(f"{class_id} 0.5 0.5 0.3 0.3\n")
+
+
+def test_augmentation_output_is_independent_of_worker_counts(tmp_path):
+    from backend.app.logic.augment_dataset import main
+    augs = ['flip', 'color', 'rotate', 'scale', 'translate', 'blur', 'cutout']
+    serial, pipelined = tmp_path / "serial", tmp_path / "pipelined"
+    _make_augmentation_dataset(serial)
+    _make_augmentation_dataset(pipelined)
+
+    serial_report = main(serial, 3, augs, None)
+    pipelined_report = main(pipelined, 3, augs, None, reader_workers=2, transform_workers=3, writer_workers=2, queue_size=2)
+
+    assert serial_report["final_image_counts"] == pipelined_report["final_image_counts"] == {"0": 5, "1": 5}
+    serial_files = sorted(p.relative_to(serial) for p in serial.rglob("*") if p.is_file())
+    assert serial_files == sorted(p.relative_to(pipelined) for p in pipelined.rglob("*") if p.is_file())
+    for rel in serial_files:
+        assert (serial / rel).read_bytes() == (pipelined / rel).read_bytes()
+
+
+def test_compose_applies_one_warp_and_exact_bboxes():
+    import cv2
+    from backend.app.logic.augment_dataset import compose, rotate
+    img = np.random.randint(0, 255, (40, 60, 3), dtype=np.uint8)
+    source = img.copy()
+    bboxes = [[0, 0.5, 0.5, 0.2, 0.3], [1, 0.3, 0.4, 0.1, 0.1]]
+
+    flipped, flipped_bboxes = compose(img, bboxes, ["flip"])
+    assert np.array_equal(flipped, cv2.flip(img, 1))
+    assert np.allclose([b[1:] for b in flipped_bboxes], [b[1:] for b in flip(img, bboxes)[1]])
+
+    # flip then translate, as in COMPOSE_ORDER, consumes the same random draws as the single-op functions.
+    _, composed_bboxes = compose(img, bboxes, ["translate", "flip"], random.Random(3))
+    _, expected = translate(*flip(img.copy(), bboxes), random.Random(3))
+    assert np.allclose([b[1:] for b in composed_bboxes], [b[1:] for b in expected])
+
+    # A rotated box grows to the envelope of its rotated corners instead of keeping its size.
+    _, rotated_bboxes = compose(img, bboxes, ["rotate"], random.Random(5))
+    _, approx_bboxes = rotate(img.copy(), bboxes, random.Random(5))
+    assert np.allclose([b[1:3] for b in rotated_bboxes], [b[1:3] for b in approx_bboxes])
+    assert all(r[3] > a[3] and r[4] > a[4] for r, a in zip(rotated_bboxes, approx_bboxes))
+    assert np.array_equal(img, source)
+
+
+def test_compose_batch_matches_compose_per_image():
+    from backend.app.logic.augment_dataset import compose, compose_batch, stack_bboxes
+    rng = np.random.default_rng(4)
+    images = np.stack([rng.integers(0, 255, (40, 60, 3), dtype=np.uint8) for _ in range(5)])
+    bboxes = [[["0", 0.5, 0.5, 0.2, 0.3], ["1", 0.05, 0.95, 0.1, 0.1]] for _ in range(5)]
+    ops = [["flip", "rotate"], ["scale", "translate", "color"], ["color", "cutout"], ["rotate", "blur"], ["translate"]]
+    box_array, image_idx = stack_bboxes(bboxes)
+
+    out, new_bboxes, new_idx, rows = compose_batch(images, box_array, image_idx, ops, [random.Random(i) for i in range(5)])
+
+    for i in range(5):
+        expected_img, expected_bboxes = compose(images[i], bboxes[i], ops[i], random.Random(i))
+        assert np.abs(out[i].astype(int) - expected_img).max() <= 1
+        assert np.allclose(new_bboxes[new_idx == i, 1:], [box[1:] for box in expected_bboxes])
+        assert [bboxes[i][row % 2][0] for row in rows[new_idx == i]] == [box[0] for box in expected_bboxes]
+
+
+def test_batched_pipeline_output_is_independent_of_worker_counts(tmp_path):
+    from backend.app.logic.augment_dataset import main
+    augs = ['flip', 'color', 'rotate', 'scale', 'translate', 'blur', 'cutout']
+    single, batched = tmp_path / "single", tmp_path / "batched"
+    _make_augmentation_dataset(single)
+    _make_augmentation_dataset(batched)
+
+    single_report = main(single, 5, augs, None, compose_augmentations=True, batch_size=3)
+    batched_report = main(batched, 5, augs, None, compose_augmentations=True, batch_size=3,
+                          reader_workers=2, transform_workers=2, writer_workers=2, queue_size=2)
+
+    assert single_report["final_image_counts"] == batched_report["final_image_counts"] == {"0": 5, "1": 5}
+
+    single_files = sorted(p.relative_to(single) for p in single.rglob("*") if p.is_file())
+    assert single_files == sorted(p.relative_to(batched) for p in batched.rglob("*") if p.is_file())
+    for rel in single_files:
+        assert (single / rel).read_bytes() == (batched / rel).read_bytes()
+
+
+def test_plan_signature_counts_uses_co_occurring_sources():
+    from backend.app.logic.augment_dataset import plan_signature_counts
+    # Classes 0..3 with 10, 4, 2 and 7 images; class 0 is the majority. {1, 2} co-occur, {3} and {0, 3} are alone.
+    signatures = [(0,), (1, 2), (1,), (3,), (0, 3)]
+    planned = plan_signature_counts(signatures, np.array([8, 2, 2, 5, 2]), target=10)
+    # {1, 2} covers both classes at once; class 3 uses {3}, which does not push class 0 past its target.
+    # Class 2 needs 8 more images from its 2 sources, so no source is copied more than 4 times.
+    assert planned.tolist() == [0, 8, 0, 3, 0]
+
+
+def test_plan_signature_counts_spreads_samples_over_sources():
+    from backend.app.logic.augment_dataset import plan_signature_counts
+    # Class 1 needs 29 more images; it appears next to class 2 in 20 images and next to class 3 in one,
+    # and both of those are already at target, so the two signatures are equally good.
+    planned = plan_signature_counts([(0,), (1, 2), (1, 3), (2,), (3,)], np.array([50, 20, 1, 30, 49]), target=50)
+    # The lone {1, 3} image is copied at most twice (the fair share), instead of 29 times.
+    assert planned.tolist() == [0, 27, 2, 0, 0]
+
+
+@pytest.mark.parametrize("sources, target", [([60, 30, 1], 90), ([1000, 100, 5], 1100)])
+def test_plan_signature_counts_keeps_the_majority_class_at_target(sources, target):
+    from backend.app.logic.augment_dataset import plan_signature_counts
+    # Class 0 is already at target; class 1 mostly appears next to it and only rarely alone.
+    planned = plan_signature_counts([(0,), (0, 1), (1,)], np.array(sources), target=target)
+    assert sources[0] + sources[1] + planned[0] + planned[1] == target
+    assert sources[1] + sources[2] + planned[1] + planned[2] == target
+
+
+def test_co_occurrence_balancing_generates_fewer_images(tmp_path):
+    import cv2
+    from backend.app.logic.augment_dataset import main
+    for strategy in ("per_class", "co_occurrence"):
+        root = tmp_path / strategy
+        (root / "images").mkdir(parents=True)
+        (root / "labels").mkdir()
+        for i in range(8):
+            cv2.imwrite(str(root / f"images/img{i}.jpg"), np.full((32, 32, 3), 30 * i, dtype=np.uint8))
+            label = "0 0.5 0.5 0.4 0.4\n" if i < 6 else "1 0.3 0.3 0.4 0.4\n2 0.7 0.7 0.4 0.4\n"
+            (root / f"labels/img{i}.txt").write_text(label)
+
+        report = main(root, 1, ["flip"], None, balancing_strategy=strategy)
+
+        if strategy == "per_class":
+            assert report["planned_augmentations"] == 8
+            assert report["planned_image_counts"] == report["final_image_counts"] == {"0": 6, "1": 10, "2": 10}
+        else:
+            assert report["planned_augmentations"] == 4
+            assert report["planned_image_counts"] == report["final_image_counts"] == {"0": 6, "1": 6, "2": 6}
+
+
+def test_co_occurrence_balancing_does_not_overshoot_the_majority_class(tmp_path):
+    import cv2
+    from collections import Counter
+    from backend.app.logic.augment_dataset import main
+    (tmp_path / "images").mkdir()
+    (tmp_path / "labels").mkdir()
+    labels = ["0 0.5 0.5 0.4 0.4\n"] * 60 + ["0 0.3 0.3 0.4 0.4\n1 0.7 0.7 0.4 0.4\n"] * 30 + ["1 0.5 0.5 0.4 0.4\n"]
+    for i, label in enumerate(labels):
+        cv2.imwrite(str(tmp_path / f"images/img{i}.jpg"), np.full((16, 16, 3), i, dtype=np.uint8))
+        (tmp_path / f"labels/img{i}.txt").write_text(label)
+
+    report = main(tmp_path, 1, ["flip"], None)
+
+    assert report["planned_augmentations"] == 59
+    assert report["final_image_counts"] == {"0": 90, "1": 90}
+    # Copying an image that also holds class 0 would push it past target, so the lone class-1 image is used.
+    uses = Counter(p.stem.split("_aug_")[0] for p in (tmp_path / "labels").glob("*_aug_*.txt"))
+    assert uses == {"img90": 59}
+
+
+def _snapshot(root):
+    return {p.relative_to(root): (p.read_bytes(), p.stat().st_ino, p.stat().st_nlink)
+            for p in root.rglob("*") if p.is_file()}
+
+@pytest.mark.parametrize("output_format", ["files", "shards"])
+def test_augmenting_a_staged_copy_leaves_the_cleaned_dataset_untouched(tmp_path, output_format):
+    from backend.app.logic.augment_dataset import main
+    from backend.app.logic.clean_dataset import clean_dataset
+    from backend.app.logic.utils import stage_directory
+    raw, cleaned, augmented = tmp_path / "raw", tmp_path / "cleaned", tmp_path / "augmented"
+    _make_augmentation_dataset(raw)
+    clean_dataset(raw, cleaned, ["class0", "class1"], output_format=output_format)
+    assert stage_directory(cleaned, augmented)["copied"] == 0
+    before = _snapshot(cleaned)
+
+    report = main(augmented, 3, ["flip", "color", "cutout"], None)
+
+    assert report["total_augmentations_applied"] == 4
+    after = _snapshot(cleaned)
+    assert {rel: data for rel, (data, _, _) in after.items()} == {rel: data for rel, (data, _, _) in before.items()}
+    for rel, (_, inode, links) in after.items():
+        staged = (augmented / rel).stat()
+        if output_format == "files" or rel.suffix == ".bin":
+            # Still one file shared by both trees: nothing was written through the link.
+            assert (inode, links) == (before[rel][1], 2) == (staged.st_ino, staged.st_nlink)
+        else:
+            # The packed index and manifest are replaced in augmented/, which unlinks them from cleaned/.
+            assert staged.st_ino != inode and links == 1
@@ -57,4 +57,127 @@ def test_clean_dataset(setup_test_dataset):
     assert (output_path / "images/valid_img.jpg").exists()
     assert not (output_path / "images/corrupted_img.jpg").exists()
     assert (output_path / "no_label/unlabeled_img.jpg").exists()
-    assert (output_path / "no_label/invalid_label_img.jpg").exists()
\ No newline at end of file
+    assert (output_path / "no_label/invalid_label_img.jpg").exists()
+
+def test_clean_dataset_parallel_matches_serial(setup_test_dataset):
+    test_dir = setup_test_dataset
+    raw_path = test_dir / "raw"
+    classes = ["class0", "class1"]
+
+    serial_stats = clean_dataset(raw_path, test_dir / "serial", classes)
+    parallel_stats = clean_dataset(raw_path, test_dir / "parallel", classes, num_workers=2)
+
+    assert parallel_stats == serial_stats
+    serial_files = sorted(p.relative_to(test_dir / "serial") for p in (test_dir / "serial").rglob("*") if p.is_file())
+    parallel_files = sorted(p.relative_to(test_dir / "parallel") for p in (test_dir / "parallel").rglob("*") if p.is_file())
+    assert parallel_files == serial_files
+    for rel in serial_files:
+        assert (test_dir / "parallel" / rel).read_bytes() == (test_dir / "serial" / rel).read_bytes()
+
+
+def test_clean_dataset_incremental_rerun_matches_full_clean(setup_test_dataset):
+    test_dir = setup_test_dataset
+    raw_path = test_dir / "raw"
+    output_path = test_dir / "cleaned"
+    classes = ["class0", "class1"]
+
+    first_stats = clean_dataset(raw_path, output_path, classes, incremental=True)
+    assert first_stats["images_reused"] == 0
+    assert (test_dir / "cleaned_manifest.json").exists()
+
+    # Fix the invalid label, drop the unlabeled image and re-clean.
+    with open(raw_path / "labels/invalid_label_img.txt", "w") as f:
+        f.write("1 0.5 0.5 0.2 0.2\n")
+    (raw_path / "images/unlabeled_img.jpg").unlink()
+    stats = clean_dataset(raw_path, output_path, classes, incremental=True)
+
+    full_stats = clean_dataset(raw_path, test_dir / "full", classes)
+    assert stats["images_reused"] == 2  # the valid and the corrupted image
+    assert {k: v for k, v in stats.items() if k != "images_reused"} == full_stats
+    assert (output_path / "labels/invalid_label_img.txt").exists()
+    assert not (output_path / "no_label").exists()
+    incremental_files = sorted(p.relative_to(output_path) for p in output_path.rglob("*") if p.is_file())
+    full_files = sorted(p.relative_to(test_dir / "full") for p in (test_dir / "full").rglob("*") if p.is_file())
+    assert incremental_files == full_files
+
+
+def test_clean_dataset_jpeg_passthrough(setup_test_dataset):
+    test_dir = setup_test_dataset
+    raw_path = test_dir / "raw"
+    output_path = test_dir / "cleaned"
+    cv2.imwrite(str(raw_path / "images/png_img.png"), np.zeros((20, 20, 3), dtype=np.uint8))
+    with open(raw_path / "labels/png_img.txt", "w") as f:
+        f.write("1 0.5 0.5 0.2 0.2\n")
+
+    stats = clean_dataset(raw_path, output_path, ["class0", "class1"], jpeg_passthrough=True)
+
+    assert stats["corrupted_removed"] == 1
+    assert stats["images_passed_through"] == 3  # valid, invalid-label and unlabeled JPEGs
+    assert stats["images_transcoded"] == 1  # the PNG
+    assert (output_path / "images/valid_img.jpg").read_bytes() == (raw_path / "images/valid_img.jpg").read_bytes()
+    assert cv2.imread(str(output_path / "images/png_img.jpg")) is not None
+
+def test_clean_dataset_records_metrics(setup_test_dataset):
+    from backend.app.logic.metrics import StageMetrics
+    test_dir = setup_test_dataset
+    reports = []
+    metrics = StageMetrics("cleaning", on_progress=reports.append, interval=0)
+    clean_dataset(test_dir / "raw", test_dir / "cleaned", ["class0", "class1"], metrics=metrics)
+    snapshot = metrics.finish()
+
+    assert snapshot["done"] == snapshot["total"] == 4
+    assert set(snapshot["phases"]) == {"scan", "process", "write", "finalize"}
+    assert snapshot["counters"]["bytes_read"] > 0
+    written = sum(p.stat().st_size for p in (test_dir / "cleaned").rglob("*") if p.is_file())
+    assert snapshot["counters"]["bytes_written"] == written
+    assert reports and reports[-1] == snapshot
+
+def test_clean_dataset_resizes_and_letterboxes(setup_test_dataset):
+    test_dir = setup_test_dataset
+    raw_path = test_dir / "raw"
+    big = np.zeros((600, 1200, 3), dtype=np.uint8)
+    big[150:450, 300:600] = 255  # the box below
+    cv2.imwrite(str(raw_path / "images/big_img.jpg"), big)
+    with open(raw_path / "labels/big_img.txt", "w") as f:
+        f.write("1 0.375 0.5 0.25 0.5\n")
+
+    stats = clean_dataset(raw_path, test_dir / "cleaned", ["class0", "class1"], max_side=200, letterbox=True,
+                          jpeg_passthrough=True)
+
+    assert stats["images_resized"] == 4  # the 100x100 JPEGs are padded
+    assert stats["images_passed_through"] == 0
+    img = cv2.imread(str(test_dir / "cleaned/images/big_img.jpg"))
+    assert img.shape == (200, 200, 3)
+    # 1200x600 -> 200x100, padded by 50 rows above and below.
+    _, x, y, w, h = (float(v) for v in (test_dir / "cleaned/labels/big_img.txt").read_text().split())
+    assert (x, y, w, h) == pytest.approx((0.375, 0.5, 0.25, 0.25))
+    assert img[100, 75].mean() > 200 and img[40, 75].mean() == pytest.approx(114, abs=3)
+    assert cv2.imread(str(test_dir / "cleaned/images/valid_img.jpg")).shape == (200, 200, 3)
+
+    stats = clean_dataset(raw_path, test_dir / "fit", ["class0", "class1"], max_side=200, jpeg_passthrough=True)
+    assert stats["images_passed_through"] == 3 and stats["images_resized"] == 1
+    assert cv2.imread(str(test_dir / "fit/images/big_img.jpg")).shape == (100, 200, 3)
+    assert (test_dir / "fit/labels/big_img.txt").read_text() == "1 0.375 0.5 0.25 0.5\n"
+
+
+def test_bounded_imap_limits_results_in_flight():
+    import time
+    from multiprocessing import Pool
+    from backend.app.logic.clean_dataset import bounded_imap
+    pulled = []
+    def items():
+        for i in range(200):
+            pulled.append(i)
+            yield i
+
+    with Pool(2) as pool:
+        results = bounded_imap(pool, abs, items(), chunksize=2, window=8)
+        try:
+            for consumed, value in enumerate(results, start=1):
+                assert value == consumed - 1
+                time.sleep(0.001)  # a slow writer
+                # 8 submitted, plus the one item the feeder holds while it waits for a slot.
+                assert len(pulled) - consumed <= 9
+        finally:
+            results.close()
+    assert len(pulled) == 200
@@ -0,0 +1,93 @@
+import random
+import cv2
+import numpy as np
+from backend.app.logic.dedup import MultiIndexHash, _plan_bands, dhash, phash
+from backend.app.logic.clean_dataset import clean_dataset
+
+def test_multi_index_hash_matches_brute_force():
+    rng = random.Random(0)
+    stored = [rng.getrandbits(64) for _ in range(2000)]
+    # Plant near neighbours of a few stored hashes.
+    queries = [stored[i] ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for i in range(0, 2000, 100)]
+    queries += [rng.getrandbits(64) for _ in range(20)]
+    index = MultiIndexHash(max_distance=4)
+    for value in stored:
+        index.add(value)
+    # The layout chosen for 2000 hashes, then ones that probe a radius of 1 and 2 bits per band.
+    for layout in (None, (3, 1), (2, 2)):
+        if layout:
+            index._layout(layout)
+        for query in queries:
+            expected = sorted(((v ^ query).bit_count(), i) for i, v in enumerate(stored) if (v ^ query).bit_count() <= 4)
+            assert index.query(query) == expected
+
+def test_multi_index_hash_widens_bands_as_it_grows():
+    assert _plan_bands(4, 1000) == (5, 0)  # 13-bit bands, exact matches only
+    assert _plan_bands(4, 1_000_000) == (3, 1)  # 21-bit bands, probing 1 bit around the query
+    index = MultiIndexHash(max_distance=4)
+    rng = random.Random(1)
+    for _ in range(100_000):
+        index.add(rng.getrandbits(64))
+    assert index._plan == (3, 1)
+
+def _make_dataset(raw):
+    (raw / "images").mkdir(parents=True)
+    (raw / "labels").mkdir()
+    rng = np.random.default_rng(1)
+    base = cv2.GaussianBlur(rng.integers(0, 255, (64, 64, 3), dtype=np.uint8), (9, 9), 0)
+    other = cv2.GaussianBlur(rng.integers(0, 255, (64, 64, 3), dtype=np.uint8), (9, 9), 0)
+    cv2.imwrite(str(raw / "images" / "a.png"), base)
+    cv2.imwrite(str(raw / "images" / "b_copy.png"), base)  # exact duplicate of a
+    cv2.imwrite(str(raw / "images" / "c_brighter.png"), cv2.convertScaleAbs(base, alpha=1.0, beta=6))  # near duplicate
+    cv2.imwrite(str(raw / "images" / "d.png"), other)
+    for name in ["a", "b_copy", "c_brighter", "d"]:
+        (raw / "labels" / f"{name}.txt").write_text("0 0.5 0.5 0.2 0.2\n")
+
+def test_hashes_are_stable_under_small_changes():
+    img = cv2.GaussianBlur(np.random.default_rng(2).integers(0, 255, (80, 80, 3), dtype=np.uint8), (9, 9), 0)
+    brighter = cv2.convertScaleAbs(img, alpha=1.0, beta=6)
+    assert (phash(img) ^ phash(brighter)).bit_count() <= 4
+    assert (dhash(img) ^ dhash(brighter)).bit_count() <= 4
+    assert (phash(img) ^ phash(np.ascontiguousarray(img[:, ::-1]))).bit_count() > 8
+
+def test_clean_dataset_duplicate_handling(tmp_path):
+    raw = tmp_path / "raw"
+    _make_dataset(raw)
+    classes = ["class0"]
+
+    report = clean_dataset(raw, tmp_path / "report", classes, duplicate_handling="report")
+    assert (report["exact_duplicates_found"], report["near_duplicates_found"]) == (1, 1)
+    assert report["valid_images_saved"] == 4 and len(list((tmp_path / "report" / "images").iterdir())) == 4
+
+    dropped = clean_dataset(raw, tmp_path / "drop", classes, duplicate_handling="drop")
+    assert dropped["duplicates_removed"] == 2 and dropped["valid_images_saved"] == 2
+    assert sorted(p.name for p in (tmp_path / "drop" / "images").iterdir()) == ["a.jpg", "d.jpg"]
+
+    out = tmp_path / "quarantine"
+    quarantined = clean_dataset(raw, out, classes, duplicate_handling="quarantine", incremental=True)
+    assert quarantined["duplicates_quarantined"] == 2
+    assert sorted(p.name for p in (out / "duplicates" / "images").iterdir()) == ["b_copy.jpg", "c_brighter.jpg"]
+
+    # Once the original is gone, the first copy becomes the kept image on an incremental re-run.
+    (raw / "images" / "a.png").unlink()
+    rerun = clean_dataset(raw, out, classes, duplicate_handling="quarantine", incremental=True)
+    assert sorted(p.name for p in (out / "images").iterdir()) == ["b_copy.jpg", "d.jpg"]
+    assert sorted(p.name for p in (out / "duplicates" / "images").iterdir()) == ["c_brighter.jpg"]
+    assert rerun["duplicates_quarantined"] == 1 and rerun["valid_images_saved"] == 2
+
+def test_passed_through_jpegs_are_matched_exactly_by_file_bytes(tmp_path):
+    raw = tmp_path / "raw"
+    (raw / "images").mkdir(parents=True)
+    (raw / "labels").mkdir()
+    img = cv2.GaussianBlur(np.random.default_rng(3).integers(0, 255, (64, 64, 3), dtype=np.uint8), (9, 9), 0)
+    data = cv2.imencode(".jpg", img)[1].tobytes()
+    comment = b"\xff\xfe\x00\x08edited"  # a COM segment: same pixels, different file bytes
+    for name, content in [("a", data), ("b_copy", data), ("c_tagged", data[:2] + comment + data[2:])]:
+        (raw / "images" / f"{name}.jpg").write_bytes(content)
+        (raw / "labels" / f"{name}.txt").write_text("0 0.5 0.5 0.2 0.2\n")
+
+    decoded = clean_dataset(raw, tmp_path / "decoded", ["c"], duplicate_handling="report")
+    assert (decoded["exact_duplicates_found"], decoded["near_duplicates_found"]) == (2, 0)
+    passed = clean_dataset(raw, tmp_path / "passed", ["c"], duplicate_handling="report", jpeg_passthrough=True)
+    assert passed["images_passed_through"] == 3
+    assert (passed["exact_duplicates_found"], passed["near_duplicates_found"]) == (1, 1)
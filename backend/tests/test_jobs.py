@@ -0,0 +1,51 @@
+from backend.app.jobs import JobStore
+
+def test_job_store_persists_and_limits_queue(tmp_path):
+    store = JobStore(tmp_path / "jobs.db")
+    store.create("a", {"status": "uploaded"})
+    store.create("b", {"status": "uploaded"})
+
+    assert store.enqueue("a", {"status": "cleaning"}, limit=1)
+    assert not store.enqueue("b", {"status": "cleaning"}, limit=1)  # queue is full
+
+    # A second store on the same file (e.g. another uvicorn worker, or after a restart) sees the same state.
+    reopened = JobStore(tmp_path / "jobs.db")
+    assert reopened.get("a")["status"] == "cleaning"
+    assert reopened.get("b")["status"] == "uploaded"
+    assert reopened.queue_info("a") == {"depth": 1, "running": 0, "state": "queued", "position": 1}
+
+    reopened.update("a", {"clean_stats": {"images_processed": 4}})
+    assert store.get("a") == {"status": "cleaning", "clean_stats": {"images_processed": 4}}
+    assert "missing" not in store
+
+def test_orphaned_jobs_are_failed_by_owner_heartbeat_not_pid(tmp_path):
+    import time
+    from backend.app.jobs import JobRunner
+    # The previous API process, e.g. in a container that restarts with the same PID.
+    old = JobStore(tmp_path / "jobs.db", instance_id="old")
+    old.heartbeat()
+    old.create("a", {"status": "uploaded"})
+    assert old.enqueue("a", {"status": "cleaning"}, limit=2)
+    old.create("c", {"status": "cleaned"})
+    assert old.enqueue("c", {"status": "augmenting"}, limit=2, stage="augmentation")
+
+    store = JobStore(tmp_path / "jobs.db")
+    sibling = JobStore(tmp_path / "jobs.db", instance_id="sibling")  # a live uvicorn worker
+    sibling.heartbeat()
+    sibling.create("b", {"status": "uploaded"})
+    assert sibling.enqueue("b", {"status": "cleaning"}, limit=3)
+
+    store.fail_orphaned_jobs(stale_after=60)
+    assert store.queue_info()["depth"] == 3  # the old owner's heartbeat is still recent
+
+    time.sleep(0.2)
+    sibling.heartbeat()
+    runner = JobRunner(store, max_workers=1, max_queued=1, heartbeat_interval=0.05)  # stale after 0.15s
+    try:
+        assert store.get("a")["status"] == "error"
+        assert store.get("a")["details"]["stage"] == "cleaning"
+        assert store.get("c")["details"]["stage"] == "augmentation"  # the name the task reports, not the status
+        assert store.get("b")["status"] == "cleaning"
+        assert store.queue_info() == {"depth": 1, "running": 0}
+    finally:
+        runner.shutdown()
@@ -0,0 +1,45 @@
+import os
+import threading
+import time
+import pytest
+from backend.app.logic.label_io import LabelWriteBuffer, list_label_files, prefetch, read_label_texts
+
+def test_prefetch_keeps_order_overlaps_reads_and_raises_in_place():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow_read(i):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01 * (i % 3))
+        with lock:
+            active[0] -= 1
+        if i == 7:
+            raise OSError("unreadable")
+        return i * i
+
+    results = []
+    with pytest.raises(OSError):
+        for item, value in prefetch(range(20), slow_read, workers=4):
+            results.append((item, value))
+    assert results == [(i, i * i) for i in range(7)]
+    assert peak[0] > 1
+
+def test_label_write_buffer_and_read_back(tmp_path):
+    labels = tmp_path / "labels"
+    labels.mkdir()
+    (tmp_path / "shared.txt").write_text("old\n")
+    os.link(tmp_path / "shared.txt", labels / "a.txt")  # e.g. hard-linked from the cleaned dataset
+    (labels / "notes.md").write_text("not a label")
+
+    with LabelWriteBuffer(labels, batch_size=2, workers=2) as writer:
+        sizes = [writer.add(f"s{i}", [["1", 0.5, 0.5, 0.1, 0.2]]) for i in range(5)]
+        writer.add("a", [])
+
+    assert (tmp_path / "shared.txt").read_text() == "old\n"
+    assert (labels / "a.txt").read_text() == ""
+    assert sizes[0] == (labels / "s0.txt").stat().st_size
+    assert list(list_label_files(labels)) == ["a", "s0", "s1", "s2", "s3", "s4"]
+    texts = dict(read_label_texts(labels, workers=3))
+    assert texts["s4"] == "1 0.500000 0.500000 0.100000 0.200000\n"
@@ -0,0 +1,23 @@
+from backend.app.logic.metrics import StageMetrics, render_prometheus
+
+def test_render_prometheus_aggregates_job_metrics():
+    metrics = StageMetrics("augmentation")
+    with metrics.phase("pipeline"):
+        metrics.add("images_processed", 3)
+    metrics.observe("flip", 0.002)
+    metrics.observe("flip", 0.2)
+    snapshot = metrics.snapshot()
+    records = [
+        {"status": "augmented", "augment_metrics": snapshot},
+        {"status": "augmented", "augment_metrics": snapshot},
+        {"status": "uploaded"},
+    ]
+    text = render_prometheus(records, {"depth": 1, "running": 0})
+
+    assert 'dataset_jobs{status="augmented"} 2' in text
+    assert "dataset_jobs_queued 1" in text
+    assert 'dataset_images_processed_total{stage="augmentation"} 6' in text
+    assert 'dataset_phase_wall_seconds_total{stage="augmentation",phase="pipeline"}' in text
+    assert 'dataset_latency_seconds_bucket{stage="augmentation",name="flip",le="0.0025"} 2' in text
+    assert 'dataset_latency_seconds_bucket{stage="augmentation",name="flip",le="+Inf"} 4' in text
+    assert 'dataset_latency_seconds_count{stage="augmentation",name="flip"} 4' in text
@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+from backend.app.logic.shards import ShardReader, ShardWriter
+from backend.app.logic.clean_dataset import clean_dataset
+from backend.app.logic.augment_dataset import main as augment_main
+
+def test_shard_writer_round_trip_replace_and_append(tmp_path):
+    with ShardWriter(tmp_path / "packed", ["a", "b"], shard_size=10) as writer:
+        writer.add("x", b"12345678", [[0, 0.5, 0.5, 0.1, 0.1]])
+        writer.add("y", b"abcdef", [[1, 0.2, 0.2, 0.1, 0.1], [0, 0.3, 0.3, 0.2, 0.2]])
+        writer.add("x", b"ZZ", [[1, 0.75, 0.75, 0.25, 0.25]])  # replaces the first "x"
+        writer.add("u", b"uu", [], labeled=False)
+    with ShardWriter(tmp_path / "packed", append=True) as writer:
+        writer.add("z", b"q", [[0, 0.5, 0.5, 0.5, 0.5]])
+
+    with ShardReader(tmp_path / "packed") as reader:
+        assert reader.names == ["y", "x", "u", "z"]
+        assert reader.num_shards == 3
+        assert [reader.read_bytes(i) for i in range(len(reader))] == [b"abcdef", b"ZZ", b"uu", b"q"]
+        assert reader.label_text(1) == "1 0.750000 0.750000 0.250000 0.250000\n"
+        assert reader.bboxes(0)[0][0] == "1" and len(reader.bboxes(0)) == 2
+        assert not reader.is_labeled(2) and reader.label_text(2) == ""
+        table = np.load(tmp_path / "packed" / "bboxes.npy", mmap_mode="r")
+        assert table["image"].tolist() == [0, 0, 1, 3]
+
+def test_bbox_table_stores_image_numbers_as_int64(tmp_path):
+    with ShardWriter(tmp_path / "packed", ["a"]) as writer:
+        writer.add("x", b"x", [[0, 0.5, 0.5, 0.1, 0.1]])
+    assert np.load(tmp_path / "packed" / "bboxes.npy").dtype["image"] == np.int64
+
+def test_convert_v1_boxes():
+    from backend.app.logic.shards import BOX_DTYPE, _convert_v1_boxes
+    table = np.array([[0, 1, 0.5, 0.5, 0.25, 0.25], [3, 0, 0.1, 0.2, 0.3, 0.4]], dtype=np.float32)
+    boxes = _convert_v1_boxes(table)
+    assert boxes.dtype == BOX_DTYPE
+    assert boxes["image"].tolist() == [0, 3] and boxes["class"].tolist() == [1, 0]
+    assert np.array_equal(np.stack([boxes[c] for c in "xywh"], axis=1), table[:, 2:])
+
+def test_clean_and_augment_packed_dataset(tmp_path):
+    raw = tmp_path / "raw"
+    (raw / "images").mkdir(parents=True)
+    (raw / "labels").mkdir()
+    img = np.random.default_rng(0).integers(0, 255, (32, 32, 3), dtype=np.uint8)
+    for i in range(5):
+        cv2.imwrite(str(raw / "images" / f"img{i}.jpg"), img)
+        (raw / "labels" / f"img{i}.txt").write_text("0 0.5 0.5 0.4 0.4\n" + ("1 0.3 0.3 0.2 0.2\n" if i == 0 else ""))
+    cv2.imwrite(str(raw / "images" / "nolabel.jpg"), img)
+
+    files_stats = clean_dataset(raw, tmp_path / "files", ["a", "b"])
+    packed_stats = clean_dataset(raw, tmp_path / "packed", ["a", "b"], output_format="shards", shard_size=2048)
+    assert packed_stats == files_stats
+    with ShardReader(tmp_path / "packed") as reader:
+        assert len(reader) == 6 and reader.num_shards > 1
+        for i, name in enumerate(reader.names):
+            assert reader.read_bytes(i) == (tmp_path / "files" / ("images" if reader.is_labeled(i) else "no_label") / f"{name}.jpg").read_bytes()
+
+    # Packed input can be cleaned again, back into the folder layout.
+    assert clean_dataset(tmp_path / "packed", tmp_path / "refiles", ["a", "b"])["valid_images_saved"] == 5
+
+    report = augment_main(tmp_path / "packed", 1, ["flip"], None, transform_workers=2)
+    assert report["final_image_counts"] == {"0": 9, "1": 5}  # every source also contains class 0
+    with ShardReader(tmp_path / "packed") as reader:
+        assert len(reader) == 10
+        assert reader.decode(9) is not None
+
+def test_packed_augmentation_keeps_appending_past_an_unreadable_source(tmp_path, monkeypatch):
+    from backend.app.logic import augment_dataset
+    ok, encoded = cv2.imencode(".jpg", np.full((16, 16, 3), 100, dtype=np.uint8))
+    with ShardWriter(tmp_path / "packed", ["a", "b"]) as writer:
+        for i in range(8):
+            writer.add(f"a{i}", encoded.tobytes(), [[0, 0.5, 0.5, 0.4, 0.4]])
+        writer.add("b0", encoded.tobytes(), [[1, 0.5, 0.5, 0.4, 0.4]])
+        writer.add("broken", b"not an image", [[1, 0.5, 0.5, 0.4, 0.4]])
+    # Record whether each shard append happens while samples are still flowing, or only at the end.
+    finished, appended_late = [], []
+    run_pipeline, add = augment_dataset.run_pipeline, ShardWriter.add
+    def spy_pipeline(*args):
+        yield from run_pipeline(*args)
+        finished.append(True)
+    def spy_add(self, *args, **kwargs):
+        appended_late.append(bool(finished))
+        return add(self, *args, **kwargs)
+    monkeypatch.setattr(augment_dataset, "run_pipeline", spy_pipeline)
+    monkeypatch.setattr(ShardWriter, "add", spy_add)
+
+    report = augment_main(tmp_path / "packed", 3, ["flip"], None)
+
+    assert report["planned_augmentations"] == 6
+    assert report["total_augmentations_applied"] == 3
+    assert appended_late == [False] * 3
+    with ShardReader(tmp_path / "packed") as reader:
+        assert len(reader) == 13 and all(name.startswith("b0_aug_") for name in reader.names[10:])
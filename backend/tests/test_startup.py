@@ -0,0 +1,24 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+def test_api_starts_without_loading_opencv_or_numpy(tmp_path):
+    # A fresh interpreter, as a new API worker; app.main creates its data/ folder in the working directory.
+    code = ("import json, sys; import app.main; "
+            "print(json.dumps([app.main.startup_info(), [m for m in ('cv2', 'numpy') if m in sys.modules]]))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env={**os.environ, "PYTHONPATH": str(BACKEND_DIR)},
+                         check=True, capture_output=True, text=True).stdout
+    info, loaded = json.loads(out.splitlines()[-1])
+
+    assert loaded == []
+    assert info["heavy_modules"] == {"cv2": False, "numpy": False}
+    assert info["import_seconds"] > 0
+
+def test_job_tasks_resolve_by_name_in_the_worker():
+    from backend.app.jobs import _resolve_task
+    assert _resolve_task("os.path:join") is os.path.join
+    assert _resolve_task(len) is len
@@ -0,0 +1,50 @@
+import io
+import zipfile
+from backend.app.logic.utils import iter_zip_stream
+
+def test_iter_zip_stream_stores_media_and_deflates_labels(tmp_path):
+    (tmp_path / "images").mkdir()
+    (tmp_path / "labels").mkdir()
+    (tmp_path / "images/a.jpg").write_bytes(b"\xff\xd8\xff" + b"\x00" * 5000)
+    (tmp_path / "labels/a.txt").write_text("0 0.5 0.5 0.1 0.1\n" * 100)
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip_stream(tmp_path, chunk_size=1024))))
+
+    assert archive.testzip() is None
+    assert archive.namelist() == ["images/", "labels/", "images/a.jpg", "labels/a.txt"]
+    assert archive.getinfo("images/a.jpg").compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo("labels/a.txt").compress_type == zipfile.ZIP_DEFLATED
+    assert archive.read("labels/a.txt") == (tmp_path / "labels/a.txt").read_bytes()
+
+def _dataset_zip(path, entries):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+
+def test_dataset_members_in_zip_strips_wrapper_folder_and_skips_unsafe_entries(tmp_path):
+    from backend.app.logic.utils import dataset_members_in_zip, extract_zip_streaming
+    _dataset_zip(tmp_path / "upload.zip", {
+        "my_dataset/classes.txt": "cat\n",
+        "my_dataset/images/a.jpg": b"\xff\xd8\xff" + bytes(3000),
+        "my_dataset/labels/a.txt": "0 0.5 0.5 0.1 0.1\n",
+        "my_dataset/../evil.txt": "outside",
+        "/etc/passwd": "absolute",
+        "__MACOSX/my_dataset/._a.jpg": "resource fork",
+        "my_dataset/.DS_Store": "finder",
+    })
+
+    with zipfile.ZipFile(tmp_path / "upload.zip") as archive:
+        assert sorted(dataset_members_in_zip(archive)) == ["classes.txt", "images/a.jpg", "labels/a.txt"]
+
+    dest = tmp_path / "raw"
+    names = extract_zip_streaming(tmp_path / "upload.zip", dest, chunk_size=256)
+    assert sorted(names) == ["classes.txt", "images/a.jpg", "labels/a.txt"]
+    assert (dest / "images/a.jpg").read_bytes() == b"\xff\xd8\xff" + bytes(3000)
+    assert sorted(str(p.relative_to(tmp_path)) for p in tmp_path.rglob("*") if p.is_file()) == [
+        "raw/classes.txt", "raw/images/a.jpg", "raw/labels/a.txt", "upload.zip"]
+
+def test_dataset_members_in_zip_keeps_unwrapped_layout(tmp_path):
+    from backend.app.logic.utils import dataset_members_in_zip
+    _dataset_zip(tmp_path / "upload.zip", {"classes.txt": "cat\n", "images/a.jpg": b"x"})
+    with zipfile.ZipFile(tmp_path / "upload.zip") as archive:
+        assert sorted(dataset_members_in_zip(archive)) == ["classes.txt", "images/a.jpg"]